@@ -0,0 +1,74 @@
+"""
+Flat forest benchmark.
+"""
+
+from argparse import ArgumentParser
+from copy import copy
+from time import perf_counter
+from warnings import simplefilter
+
+from numpy import array_equal
+from numpy import float32
+from numpy import mean
+from numpy import median
+from numpy.random import default_rng
+
+from data import features
+from data import read_data_set
+from ml import FlatForest
+from ml import load_model
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Compares the latency of a flat forest with the one of scikit-learn")
+parser.add_argument("--data_set", default="datasets/dev.csv.gz",
+                    help="the name of the data set to sample (a CSV file or a columnar folder)")
+parser.add_argument("--sizes", default="1,4,16,64,256,1024,4096", help="the comma separated list of the batch sizes")
+parser.add_argument("--repetitions", type=int, default=20, help="the number of batches of every size")
+parser.add_argument("--step", type=int, default=25, help="the number of trees evaluated at a time by the early exit")
+parser.add_argument("--tolerance", type=float, default=0,
+                    help="the maximum probability that the early exit changes the class of a sample")
+parser.add_argument("model", help="the name of a forest model")
+args = parser.parse_args()
+
+simplefilter(action="ignore", category=UserWarning)
+
+# Loads the model and the data.
+model = load_model(args.model)
+forest = model["classifier"]
+flat = model["flat"] if "flat" in model else FlatForest(forest)
+# The reference probabilities are computed on a single job, since the threads of scikit-learn sum the trees in a varying
+# order.
+reference = copy(forest).set_params(n_jobs=1)
+x = model["scaler"].transform(read_data_set(args.data_set, features).loc[:, features].astype(float32))
+random = default_rng(0)
+
+# Measures the median latencies.
+print("%8s %12s %12s %8s %6s %12s %8s %10s" % ("size", "sklearn [ms]", "flat [ms]", "speedup", "exact", "early [ms]",
+                                               "trees", "agreement"))
+for size in [int(i) for i in args.sizes.split(",")]:
+    forest_times = []
+    flat_times = []
+    early_times = []
+    exact = True
+    trees = []
+    agreement = []
+    for _ in range(args.repetitions):
+        batch = x[random.integers(0, len(x), size)]
+        begin = perf_counter()
+        expected = forest.predict_proba(batch)
+        forest_times.append(perf_counter() - begin)
+        expected = reference.predict_proba(batch)
+        begin = perf_counter()
+        p = flat.predict_proba(batch)
+        flat_times.append(perf_counter() - begin)
+        exact = exact and array_equal(expected, p)
+        begin = perf_counter()
+        p, used = flat.predict_proba_early(batch, args.step, args.tolerance)
+        early_times.append(perf_counter() - begin)
+        trees.append(mean(used))
+        agreement.append(mean(p.argmax(axis=1) == expected.argmax(axis=1)))
+    print("%8d %12.3f %12.3f %8.2f %6s %12.3f %8.1f %10.5f" % (size, median(forest_times) * 1000,
+                                                              median(flat_times) * 1000,
+                                                              median(forest_times) / median(flat_times), exact,
+                                                              median(early_times) * 1000, mean(trees),
+                                                              mean(agreement)))
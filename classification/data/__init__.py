@@ -2,4 +2,7 @@
 Data set stuff.
 """
 
+from .columnar import read_columnar
+from .columnar import read_data_set
 from .config import features
+from .weights import weights_of
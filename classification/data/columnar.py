@@ -0,0 +1,68 @@
+"""
+Data set loading functions.
+"""
+from json import load
+from os.path import isdir
+from typing import Optional
+from typing import Sequence
+
+from numpy import empty
+from numpy import memmap
+from pandas import Categorical
+from pandas import DataFrame
+from pandas import read_csv
+
+
+def read_columnar(path: str, columns: Optional[Sequence[str]] = None, optional: Sequence[str] = ()) -> DataFrame:
+    """
+    Reads a data set stored in the columnar format written by build_dataset.py. Only the requested columns are touched:
+    the numeric ones stay memory-mapped in the data frame, while the categorical ones are rebuilt in memory from their
+    codes, narrowed by pandas to the smallest integer type, and stored categories.
+
+    :param path: the name of the data set folder
+    :param columns: the columns to read or None to read all of them
+    :param optional: some additional columns to read only if they are available
+    :return: the data set
+    """
+
+    with open("%s/meta.json" % path) as f:
+        meta = load(f)
+
+    rows = meta["rows"]
+    available = {i["name"]: i for i in meta["columns"]}
+    if columns is None:
+        columns = list(available)
+    else:
+        columns = [*columns, *[i for i in optional if i in available and i not in columns]]
+
+    data = {}
+    for name in columns:
+        column = available[name]
+        if rows > 0:
+            values = memmap("%s/%s.bin" % (path, name), dtype=column["dtype"], mode="r", shape=(rows,))
+        else:
+            values = empty(0, dtype=column["dtype"])
+        if "categories" in column:
+            values = Categorical.from_codes(values, categories=column["categories"])
+        data[name] = values
+
+    return DataFrame(data, columns=list(columns), copy=False)
+
+
+def read_data_set(path: str, columns: Optional[Sequence[str]] = None, optional: Sequence[str] = ()) -> DataFrame:
+    """
+    Reads a data set, either a columnar folder or a CSV file.
+
+    :param path: the name of the data set
+    :param columns: the columns to read or None to read all of them
+    :param optional: some additional columns to read only if they are available
+    :return: the data set
+    """
+
+    if isdir(path):
+        return read_columnar(path, columns, optional)
+    elif columns is None:
+        return read_csv(path)
+    else:
+        wanted = {*columns, *optional}
+        return read_csv(path, usecols=lambda i: i in wanted)
@@ -0,0 +1,22 @@
+"""
+Sample weights functions.
+"""
+from typing import Optional
+
+from pandas import DataFrame
+from pandas import Series
+
+
+def weights_of(data_set: DataFrame) -> Optional[Series]:
+    """
+    Retrieves the sample weights of a data set, i.e. the number of identical flows every row stands for.
+
+    :param data_set: the data set
+    :return: the weights or None if the data set has not been deduplicated
+    """
+
+    if "weight" in data_set:
+        return data_set["weight"].astype(int)
+    else:
+        return None
+
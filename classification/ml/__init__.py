@@ -3,8 +3,25 @@ Machine-learning stuff.
 """
 
 from .classification import classify
+from .classification import classify_early
+from .classification import flat_forest
+from .classification import probabilities
+from .classification import scale
+from .forest import FlatForest
 from .nn import NeuralModule
+from .optimization import balanced_class_weights
 from .optimization import optimize
+from .serving import Batcher
+from .serving import Failed
+from .serving import InferenceServer
+from .serving import Overloaded
+from .serving import TooLarge
+from .storage import load_model
+from .storage import packed
+from .storage import save_model
+from .streaming import LogFollower
+from .streaming import TstatFollower
+from .streaming import classify_stream
 from .ui import print_confusion
 from .ui import print_data_set
 from .ui import print_ensemble_statistics
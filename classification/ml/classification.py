@@ -1,21 +1,71 @@
 """
 Classification functions.
 """
+from pickle import dumps
 from typing import Any
 from typing import Dict
+from typing import Optional
 from typing import Tuple
 
+from numpy import concatenate
+from numpy import empty
+from numpy import ndarray
 from pandas import DataFrame
 from pandas import Series
 
+from .forest import FlatForest
 
-def classify(model: Dict[str, Any], x: DataFrame, classes: Dict[int, str]) -> Tuple[Series, DataFrame]:
+# The largest batches classified by the flat forests of the models, the larger ones being faster with scikit-learn.
+_flat_rows = 64
+
+
+def scale(scaler: Any, x: DataFrame, chunk_size: int = 65536) -> ndarray:
+    """
+    Scales some data a chunk at a time, so that only the scaled matrix is allocated.
+
+    :param scaler: the scaler to use
+    :param x: the input data
+    :param chunk_size: the number of rows scaled at once
+    :return: the scaled data
+    """
+
+    scaled = None
+    for start in range(0, len(x), chunk_size):
+        chunk = scaler.transform(x.iloc[start:start + chunk_size])
+        if scaled is None:
+            scaled = empty((len(x), chunk.shape[1]), dtype=chunk.dtype)
+        scaled[start:start + len(chunk)] = chunk
+
+    return scaled if scaled is not None else empty((0, x.shape[1]), dtype=x.to_numpy().dtype)
+
+
+def probabilities(model: Dict[str, Any], x: ndarray) -> ndarray:
     """
-    Classifies some data.
+    Computes the class probabilities of some scaled data, with the flat forest of the model for the small batches.
+
+    :param model: the model to use
+    :param x: the scaled input data
+    :return: the probabilities
+    """
+
+    if "flat" in model and len(x) <= _flat_rows:
+        return model["flat"].predict_proba(x)
+    else:
+        return model["classifier"].predict_proba(x)
+
+
+def classify(model: Dict[str, Any], x: DataFrame, classes: Dict[int, str], chunk_size: int = 65536,
+             cache: Optional[Dict[Tuple[bytes, int], Tuple[DataFrame, ndarray]]] = None) -> Tuple[Series, DataFrame]:
+    """
+    Classifies some data. The probabilities are computed once, a chunk at a time so that the memory needed does not
+    grow with the input, and the classes are their argmax.
 
     :param model: the model to use
     :param x: the input data
     :param classes: the dict for decoding the outputs
+    :param chunk_size: the number of rows classified at once
+    :param cache: a dict where the scaled data is kept and shared by all the models with an identical scaler, trading
+                  the memory of the scaled data for a single scaling, or None to scale every chunk when needed
     :return: a tuple where the first element is the class and the second the probabilities.
     """
 
@@ -23,11 +73,72 @@ def classify(model: Dict[str, Any], x: DataFrame, classes: Dict[int, str]) -> Tu
     numbers = model["numbers"]
     classifier = model["classifier"]
 
-    x = scaler.transform(x)
+    scaled = None
+    if cache is not None:
+        # The input is kept in the cache too, so that its id cannot be reused by another input.
+        key = (dumps(scaler), id(x))
+        if key not in cache:
+            cache[key] = (x, scale(scaler, x, chunk_size))
+        scaled = cache[key][1]
 
-    yy = Series(classifier.predict(x))
-    p = DataFrame(data=classifier.predict_proba(x), columns=classes.values())
+    p = []
+    for start in range(0, len(x), chunk_size):
+        if scaled is None:
+            chunk = scaler.transform(x.iloc[start:start + chunk_size])
+        else:
+            chunk = scaled[start:start + chunk_size]
+        p.append(probabilities(model, chunk))
+    p = concatenate(p) if p else empty((0, len(classes)))
+
+    indices = p.argmax(axis=1)
     if numbers:
-        yy = yy.map(classes).astype("category")
+        yy = Series(indices).map(classes).astype("category")
+    else:
+        yy = Series(classifier.classes_[indices])
+    p = DataFrame(data=p, columns=classes.values())
 
     return yy, p
+
+
+def flat_forest(model: Dict[str, Any]) -> FlatForest:
+    """
+    Gets the flat forest of a model, flattening its forest the first time and storing it in the model.
+
+    :param model: the model to use, with a forest classifier
+    :return: the flat forest
+    """
+
+    if "flat" not in model:
+        model["flat"] = FlatForest(model["classifier"])
+
+    return model["flat"]
+
+
+def classify_early(model: Dict[str, Any], x: DataFrame, classes: Dict[int, str], step: int = 25,
+                   tolerance: float = 0) -> Tuple[Series, DataFrame, ndarray]:
+    """
+    Classifies some data with the early-exit evaluation of a forest, which stops evaluating the trees for a sample as
+    soon as its class is decided.
+
+    :param model: the model to use, with a forest classifier
+    :param x: the input data
+    :param classes: the dict for decoding the outputs
+    :param step: the number of trees evaluated at a time
+    :param tolerance: the maximum probability that the class of a sample differs from the one of the whole forest
+    :return: a tuple where the first element is the class, the second the probabilities and the third the number of
+             trees used for every sample
+    """
+
+    numbers = model["numbers"]
+    flat = flat_forest(model)
+
+    p, used = flat.predict_proba_early(model["scaler"].transform(x), step, tolerance)
+
+    indices = p.argmax(axis=1)
+    if numbers:
+        yy = Series(indices).map(classes).astype("category")
+    else:
+        yy = Series(flat.classes_[indices])
+    p = DataFrame(data=p, columns=classes.values())
+
+    return yy, p, used
@@ -0,0 +1,219 @@
+"""
+Tree ensemble functions.
+"""
+from math import ceil
+from math import log
+from typing import Any
+from typing import Tuple
+
+from numpy import arange
+from numpy import array
+from numpy import asarray
+from numpy import concatenate
+from numpy import cumsum
+from numpy import empty
+from numpy import float32
+from numpy import float64
+from numpy import inf
+from numpy import int64
+from numpy import isnan
+from numpy import ndarray
+from numpy import nextafter
+from numpy import partition
+from numpy import searchsorted
+from numpy import sqrt
+from numpy import stack
+from numpy import where
+from numpy import zeros
+
+
+class FlatForest:
+    """
+    A forest classifier flattened into contiguous node arrays, so that a batch is evaluated on all the trees at once
+    with a few vectorized operations per tree level instead of a Python call per tree. The leaves point to themselves,
+    so every sample simply descends as many levels as the deepest tree. The probabilities are bit-exact with the ones
+    of the predict_proba() of the forest with n_jobs=1: the inputs are compared as 32-bit floats and the leaf
+    probabilities are summed in the order of the trees. With more jobs, scikit-learn sums the trees in the order its
+    threads end, so its probabilities differ in the last bits. The evaluation is bound by the random accesses to the nodes, so it pays off for small
+    batches, where the overhead of scikit-learn dominates.
+    """
+
+    def __init__(self, forest: Any, chunk_size: int = 4096):
+        """
+        Flattens a forest.
+
+        :param forest: a fitted random forest or extra-trees classifier
+        :param chunk_size: the number of samples evaluated at once, bounding the memory needed
+        """
+
+        trees = [i.tree_ for i in forest.estimators_]
+        offsets = cumsum([0] + [i.node_count for i in trees])
+        nodes = arange(offsets[-1], dtype=int64)
+        leaves = concatenate([i.children_left for i in trees]) < 0
+        threshold = where(leaves, 0, concatenate([i.threshold for i in trees]))
+        left = where(leaves, nodes, concatenate([i.children_left + j for i, j in zip(trees, offsets)]))
+        right = where(leaves, nodes, concatenate([i.children_right + j for i, j in zip(trees, offsets)]))
+
+        self.classes_ = forest.classes_
+        self.__chunk_size = chunk_size
+        self.__roots = offsets[:-1].astype(int64)
+        self.__depths = array([i.max_depth for i in trees], dtype=int64)
+        self.__feature = where(leaves, 0, concatenate([i.feature for i in trees])).astype(int64)
+        # A 32-bit input is not greater than a threshold if and only if it is not greater than the largest 32-bit float
+        # not greater than the threshold.
+        self.__threshold = threshold.astype(float32)
+        above = self.__threshold.astype(float64) > threshold
+        self.__threshold[above] = nextafter(self.__threshold[above], float32(-inf))
+        # The children of the node i are at 2 * i and 2 * i + 1.
+        self.__children = stack([left, right], axis=1).ravel()
+        # The nodes sending the missing values to the left child, or None if there are none.
+        self.__missing = None
+        if all(hasattr(i, "missing_go_to_left") for i in trees):
+            missing = concatenate([i.missing_go_to_left for i in trees]).astype(bool) & ~leaves
+            self.__missing = missing if missing.any() else None
+        self.__values = concatenate([i.value[:, 0, :len(self.classes_)] for i in trees]).astype(float64)
+        # Older versions of scikit-learn store the (weighted) sample counts instead of the fractions in the leaves.
+        sums = self.__values.sum(axis=1)
+        if (abs(sums[leaves] - 1) > 1e-6).any():
+            sums[sums == 0] = 1
+            self.__values /= sums[:, None]
+
+    def __descend(self, x: ndarray, trees: slice = slice(None)) -> ndarray:
+        """
+        Finds the leaves reached by a chunk of samples.
+
+        :param x: the input samples, as 32-bit floats
+        :param trees: the trees to evaluate
+        :return: the global indices of the leaves, a row per tree and a column per sample
+        """
+
+        # The inputs are laid out a feature at a time, so that the samples reaching the same node are close.
+        flat = x.T.ravel()
+        samples = arange(len(x), dtype=int64)[None, :]
+        nodes = self.__roots[trees, None].repeat(len(x), axis=1)
+        for _ in range(self.__depths[trees].max()):
+            v = flat[self.__feature[nodes] * len(x) + samples]
+            right = ~(v <= self.__threshold[nodes])
+            if self.__missing is not None:
+                right &= ~(isnan(v) & self.__missing[nodes])
+            nodes = self.__children[2 * nodes + right]
+
+        return nodes
+
+    def apply(self, x: Any) -> ndarray:
+        """
+        Finds the leaves reached by some samples.
+
+        :param x: the input samples
+        :return: the global indices of the leaves, a row per sample and a column per tree
+        """
+
+        x = asarray(x, dtype=float32)
+        leaves = empty((len(x), len(self.__roots)), dtype=int64)
+        for start in range(0, len(x), self.__chunk_size):
+            leaves[start:start + self.__chunk_size] = self.__descend(x[start:start + self.__chunk_size]).T
+
+        return leaves
+
+    def predict_proba(self, x: Any) -> ndarray:
+        """
+        Computes the class probabilities of some samples.
+
+        :param x: the input samples
+        :return: the probabilities, a row per sample and a column per class
+        """
+
+        x = asarray(x, dtype=float32)
+        p = empty((len(x), len(self.classes_)), dtype=float64)
+        for start in range(0, len(x), self.__chunk_size):
+            leaves = self.__descend(x[start:start + self.__chunk_size])
+            # Summing along the first axis adds the trees one at a time, in the same order as scikit-learn.
+            p[start:start + leaves.shape[1]] = self.__values[leaves].sum(axis=0)
+        p /= len(self.__roots)
+
+        return p
+
+    def __early(self, x: ndarray, step: int, tolerance: float) -> Tuple[ndarray, ndarray]:
+        """
+        Computes the class probabilities of a chunk of samples with an early exit.
+
+        :param x: the input samples, as 32-bit floats
+        :param step: the number of trees evaluated at a time
+        :param tolerance: the maximum probability that the class of a sample differs from the one of the whole forest
+        :return: a tuple where the first element is the probabilities and the second the number of trees used by every
+                 sample
+        """
+
+        count = len(self.__roots)
+        sums = zeros((len(x), len(self.classes_)), dtype=float64)
+        used = zeros(len(x), dtype=int64)
+        active = arange(len(x), dtype=int64)
+        steps = []
+
+        # No sample can stop before the first check, so the trees before it are evaluated at once.
+        start = 0
+        end = count // 2 + 1
+        if tolerance > 0:
+            end = min(end, int(ceil(2 * log(1 / tolerance))))
+        end = max(end, 1)
+        while True:
+            leaves = self.__descend(x[active], slice(start, end))
+            steps.append((active, leaves))
+            sums[active] += self.__values[leaves].sum(axis=0)
+            used[active] = end
+            if end >= count or len(self.classes_) < 2:
+                break
+
+            # Every tree adds at most 1 to the votes of a class.
+            top = partition(sums[active], len(self.classes_) - 2, axis=1)
+            margin = top[:, -1] - top[:, -2]
+            done = margin > count - end + 1e-9
+            if tolerance > 0:
+                done |= margin / end >= sqrt(2 * log(1 / tolerance) / end)
+            active = active[~done]
+            if len(active) == 0:
+                break
+            start, end = end, min(end + step, count)
+
+        if end >= count and len(active) > 0:
+            # The samples using all the trees are summed again one tree at a time, as in predict_proba().
+            leaves = concatenate([j[:, searchsorted(i, active)] for i, j in steps])
+            sums[active] = self.__values[leaves].sum(axis=0)
+        sums /= used[:, None]
+
+        return sums, used
+
+    def predict_proba_early(self, x: Any, step: int = 25, tolerance: float = 0) -> Tuple[ndarray, ndarray]:
+        """
+        Computes the class probabilities of some samples, evaluating the trees a few at a time and stopping for every
+        sample as soon as its leading class is decided. With no tolerance, a sample stops when the votes of the
+        remaining trees cannot change its leading class, so the classes are always the ones of the whole forest. With a
+        tolerance, a sample also stops when the Hoeffding bound on the probability that the whole forest chooses another
+        class, treating the votes of the trees as independent, drops below the tolerance. The probabilities of a sample
+        are the average of the trees it used, bit-exact with predict_proba() when it used all of them.
+
+        :param x: the input samples
+        :param step: the number of trees evaluated at a time
+        :param tolerance: the maximum probability that the class of a sample differs from the one of the whole forest
+        :return: a tuple where the first element is the probabilities and the second the number of trees used by every
+                 sample
+        """
+
+        x = asarray(x, dtype=float32)
+        p = empty((len(x), len(self.classes_)), dtype=float64)
+        used = empty(len(x), dtype=int64)
+        for start in range(0, len(x), self.__chunk_size):
+            p[start:start + self.__chunk_size], used[start:start + self.__chunk_size] = \
+                self.__early(x[start:start + self.__chunk_size], step, tolerance)
+
+        return p, used
+
+    def predict(self, x: Any) -> ndarray:
+        """
+        Classifies some samples.
+
+        :param x: the input samples
+        :return: the classes
+        """
+
+        return self.classes_.take(self.predict_proba(x).argmax(axis=1), axis=0)
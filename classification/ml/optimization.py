@@ -1,50 +1,112 @@
 """
 Bayesian optimization stuff.
 """
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from contextlib import nullcontext
+from inspect import signature
+from os import cpu_count
+from os import getpid
+from os import makedirs
+from os import remove
+from os import replace
 from os.path import exists
+from time import monotonic
 from typing import Any
 from typing import Dict
+from typing import Optional
 from typing import Sequence
+from typing import Tuple
 from typing import Type
 
 from colorama import Fore
 from colorama import Style
+from hyperopt import JOB_STATE_DONE
+from hyperopt import JOB_STATE_ERROR
+from hyperopt import JOB_STATE_RUNNING
+from hyperopt import STATUS_OK
+from hyperopt import Domain
 from hyperopt import Trials
-from hyperopt import fmin
 from hyperopt import space_eval
 from hyperopt import tpe
-from hyperopt.early_stop import no_progress_loss
+from hyperopt.base import spec_from_misc
+from hyperopt.utils import coarse_utcnow
 from joblib import dump
+from joblib import hash
+from joblib import load
+from numpy import arange
+from numpy import argsort
+from numpy import bincount
+from numpy import cumsum
+from numpy import empty
+from numpy import flatnonzero
 from numpy import int64
+from numpy import ndarray
+from numpy import repeat
+from numpy import unique
+from numpy.random import default_rng
 from pandas import DataFrame
+from pandas import Series
 from sklearn.base import ClassifierMixin
 from sklearn.metrics import matthews_corrcoef
 from sklearn.preprocessing import StandardScaler
 
+# The data of the trials evaluated by a worker process.
+_worker: Dict[str, Any] = {}
+
+
+def balanced_class_weights(y: Series, weights: Optional[Series] = None) -> ndarray:
+    """
+    Computes the balanced class weights, i.e. the same ones computed by scikit-learn for class_weight="balanced", taking
+    into account the sample weights.
+
+    :param y: the categorical output samples
+    :param weights: the sample weights or None
+    :return: the weight of every category
+    """
+
+    counts = bincount(y.cat.codes, weights=weights, minlength=len(y.cat.categories))
+
+    return counts.sum() / (len(y.cat.categories) * counts)
+
 
 def __train(clazz: Type[ClassifierMixin], extra: Dict[Any, Any], hyperparameters: Dict[str, Sequence[Any]],
-            x_train: DataFrame, y_train: DataFrame) -> ClassifierMixin:
+            x_train: DataFrame, y_train: DataFrame, w_train: Optional[ndarray] = None) -> ClassifierMixin:
     """
-    Trains a classifier.
+    Trains a classifier. The sample weights are passed to the classifiers supporting them, which is not the same as
+    training on the repeated samples: min_samples_split and min_samples_leaf of the trees count the unique samples (this
+    only matters above 2 and 1, since a node of identical samples cannot be split anyway), and the bootstrap of a random
+    forest draws as many unique samples as there are, uniformly, so every flow has the same expected weight but a
+    different variance.
 
     :param clazz: the base class to use
     :param extra: extra class parameters
     :param hyperparameters: the hyperparameters to use
     :param x_train: the input training samples
     :param y_train: the output training samples
+    :param w_train: the training sample weights or None
     :return: the classifier
     """
 
     # noinspection PyArgumentList
     classifier = clazz(**extra, **hyperparameters)
     # noinspection PyUnresolvedReferences
-    classifier.fit(x_train, y_train)
+    if w_train is None:
+        classifier.fit(x_train, y_train)
+    elif "sample_weight" in signature(classifier.fit).parameters:
+        classifier.fit(x_train, y_train, sample_weight=w_train)
+    else:
+        # The classifiers not supporting the sample weights are trained on the repeated samples.
+        classifier.fit(repeat(x_train, w_train, axis=0), repeat(y_train, w_train))
 
     return classifier
 
 
 def __evaluate(clazz: Type[ClassifierMixin], extra: Dict[Any, Any], hyperparameters: Dict[str, Sequence[Any]],
-               x_train: DataFrame, y_train: DataFrame, x_dev: DataFrame, y_dev: DataFrame) -> float:
+               x_train: DataFrame, y_train: DataFrame, x_dev: DataFrame, y_dev: DataFrame,
+               w_train: Optional[ndarray] = None, w_dev: Optional[ndarray] = None) -> float:
     """
     Trains a classifier and computes its MCC.
 
@@ -55,22 +117,286 @@ def __evaluate(clazz: Type[ClassifierMixin], extra: Dict[Any, Any], hyperparamet
     :param y_train: the output training samples
     :param x_dev: the input development samples
     :param y_dev: the output development samples
+    :param w_train: the training sample weights or None
+    :param w_dev: the development sample weights or None
     :return: the inverse of the MCC
     """
 
     # noinspection PyArgumentList
-    classifier = __train(clazz, extra, hyperparameters, x_train, y_train)
+    classifier = __train(clazz, extra, hyperparameters, x_train, y_train, w_train)
     # noinspection PyUnresolvedReferences
     y_predicted = classifier.predict(x_dev)
 
-    return -matthews_corrcoef(y_dev, y_predicted)
+    return -matthews_corrcoef(y_dev, y_predicted, sample_weight=w_dev)
+
+
+def __quantiles(y: Series) -> ndarray:
+    """
+    Computes the position of every sample in a random order of the samples of its class, as a fraction of the class
+    size, so that the samples below a fraction form a stratified subsample, and the subsamples are nested.
+
+    :param y: the output samples
+    :return: the quantile of every sample
+    """
+
+    _, codes = unique(y.to_numpy(), return_inverse=True)
+    counts = bincount(codes)
+    # The samples shuffled and then grouped by class.
+    order = default_rng(0).permutation(len(codes))
+    order = order[argsort(codes[order], kind="stable")]
+    quantiles = empty(len(codes))
+    quantiles[order] = (arange(len(codes)) - (cumsum(counts) - counts)[codes[order]]) / counts[codes[order]]
+
+    return quantiles
+
+
+def __setup(clazz: Type[ClassifierMixin], extra: Dict[Any, Any], x_train: DataFrame, y_train: DataFrame,
+            x_dev: DataFrame, y_dev: DataFrame, w_train: Optional[ndarray], w_dev: Optional[ndarray],
+            budget: Optional[str], quantiles: Optional[ndarray]) -> None:
+    """
+    Stores the data of the trials in the process evaluating them, so that it is sent only once to a worker process.
+
+    :param clazz: the base class to use
+    :param extra: extra class parameters
+    :param x_train: the input training samples
+    :param y_train: the output training samples
+    :param x_dev: the input development samples
+    :param y_dev: the output development samples
+    :param w_train: the training sample weights or None
+    :param w_dev: the development sample weights or None
+    :param budget: the hyper-parameter or the extra class parameter scaled with the fidelity or None
+    :param quantiles: the quantiles of the training samples or None
+    """
+
+    _worker.update(clazz=clazz, extra=extra, x_train=x_train, y_train=y_train, x_dev=x_dev, y_dev=y_dev,
+                   w_train=w_train, w_dev=w_dev, budget=budget, quantiles=quantiles)
+
+
+def __trial(hyperparameters: Dict[str, Sequence[Any]], fidelity: float = 1) -> float:
+    """
+    Evaluates a trial with the stored data. A trial at a lower fidelity is trained on the stratified subsample with that
+    fraction of the training samples, and with the same fraction of the budget, e.g. of the trees or of the epochs.
+
+    :param hyperparameters: the hyperparameters to use
+    :param fidelity: the fraction of the training samples and of the budget, 1 for the full training
+    :return: the inverse of the MCC
+    """
+
+    data = dict(_worker)
+    budget = data.pop("budget")
+    quantiles = data.pop("quantiles")
+    if fidelity < 1:
+        rows = flatnonzero(quantiles < fidelity)
+        data["x_train"] = data["x_train"][rows]
+        data["y_train"] = data["y_train"].iloc[rows]
+        if data["w_train"] is not None:
+            data["w_train"] = data["w_train"][rows]
+        if budget in hyperparameters:
+            hyperparameters = {**hyperparameters, budget: max(round(hyperparameters[budget] * fidelity), 1)}
+        elif budget in data["extra"]:
+            data["extra"] = {**data["extra"], budget: max(round(data["extra"][budget] * fidelity), 1)}
+
+    return __evaluate(hyperparameters=hyperparameters, **data)
+
+
+def __key(fingerprint: str, clazz: Type[ClassifierMixin], extra: Dict[Any, Any],
+          hyperparameters: Dict[str, Sequence[Any]], fidelity: float) -> str:
+    """
+    Computes the key of a trial in the cache of the losses.
+
+    :param fingerprint: the hash of the data
+    :param clazz: the base class to use
+    :param extra: extra class parameters, where n_jobs is ignored since it does not change the classifier
+    :param hyperparameters: the hyperparameters to use
+    :param fidelity: the fidelity of the trial
+    :return: the key
+    """
+
+    return hash((fingerprint, clazz, {k: v for k, v in extra.items() if k != "n_jobs"}, hyperparameters, fidelity))
+
+
+def __search(clazz: Type[ClassifierMixin], extra: Dict[Any, Any], space: Dict[str, Any], x_train: DataFrame,
+             y_train: DataFrame, x_dev: DataFrame, y_dev: DataFrame, w_train: Optional[ndarray],
+             w_dev: Optional[ndarray], timeout: int, window_size: int, parallel: int, checkpoint: str,
+             budget: Optional[str], fidelities: int, eta: int, cache: Optional[str]) -> Tuple[Dict[str, Any], Trials]:
+    """
+    Performs a TPE search, possibly evaluating several trials at once on a pool of processes. A new trial is suggested
+    as soon as another one ends, taking into account all the ended trials, while the running ones count as failures so
+    that TPE avoids suggesting them again. The search stops after the timeout, after 1024 trials or when the best MCC
+    has not improved for a window of trials, once the running trials end. The state of the search is saved after every
+    trial, and a search finding its checkpoint resumes from it, discarding the trials that were running. A checkpoint of
+    a search with other data, classifier, space, budget or fidelities is discarded.
+
+    With several fidelities, the search performs an asynchronous successive halving: the new trials are evaluated at the
+    lowest fidelity, a fraction 1 / eta ** (fidelities - 1) of the training samples and of the budget, and a trial in
+    the best 1 / eta of the ones evaluated at a fidelity is promoted to the next one, eta times higher, as soon as a
+    process is free. TPE sees the MCC at the highest fidelity reached, while the stability window and the best point
+    only take into account the trials at full fidelity.
+
+    The losses are stored in a cache shared by all the searches, and a trial already evaluated with the same data,
+    class, extra class parameters, hyper-parameters and fidelity gets its stored loss instead of being trained again.
+    Every loss is stored in its own file, so that the searches running at once never overwrite the losses of the others
+    and see them as soon as they are stored.
+
+    :param clazz: the base class to use
+    :param extra: extra class parameters, where n_jobs is the number of cores shared by all the trials
+    :param space: the hyper-parameter space
+    :param x_train: the input training samples
+    :param y_train: the output training samples
+    :param x_dev: the input development samples
+    :param y_dev: the output development samples
+    :param w_train: the training sample weights or None
+    :param w_dev: the development sample weights or None
+    :param timeout: the timeout in seconds, not counting the time before a resumption
+    :param window_size: the window size for the stability check
+    :param parallel: the number of trials evaluated at once, at most the cores of n_jobs if any, 1 for evaluating them
+                     in this process
+    :param checkpoint: the file name for the state of the search
+    :param budget: the hyper-parameter or the extra class parameter scaled with the fidelity or None
+    :param fidelities: the number of fidelities, 1 for evaluating every trial at full fidelity
+    :param eta: the ratio between two consecutive fidelities
+    :param cache: the folder for the cache of the losses or None
+    :return: a tuple where the first element is the best point of the space and the second the trials
+    """
+
+    if parallel > 1 and "n_jobs" in extra:
+        cores = cpu_count() if extra["n_jobs"] is None else extra["n_jobs"]
+        # Negative values count the cores backwards, as in joblib.
+        cores = max(cpu_count() + 1 + cores if cores < 0 else cores, 1)
+        # The trials running at once never use more cores than the budget.
+        parallel = min(parallel, cores)
+        extra = {**extra, "n_jobs": cores // parallel}
+
+    fingerprint = hash((x_train, y_train, x_dev, y_dev, w_train, w_dev))
+    # A checkpoint can only be resumed by the same search, otherwise e.g. its rungs do not match the fidelities.
+    search = hash((fingerprint, clazz, {k: v for k, v in extra.items() if k != "n_jobs"}, space, budget, fidelities,
+                   eta))
+    state = load(checkpoint) if exists(checkpoint) else None
+    if state is not None and state.get("search") != search:
+        print("discarding the checkpoint of a different search...")
+        state = None
+    if state is not None:
+        for doc in state["trials"].trials:
+            if doc["state"] == JOB_STATE_RUNNING:
+                doc["state"] = JOB_STATE_ERROR
+        state["trials"].refresh()
+        print("resuming from %d trials..." % len(state["trials"]))
+    else:
+        # The best loss at full fidelity and the number of trials at full fidelity since it last improved, in the order
+        # the trials end, and the loss of every trial evaluated at every fidelity.
+        state = {
+                "search":  search,
+                "trials":  Trials(),
+                "random":  default_rng(),
+                "best":    None,
+                "stale":   0,
+                "elapsed": 0.0,
+                "rungs":   [{} for _ in range(fidelities)]
+        }
+    trials = state["trials"]
+    rungs = state["rungs"]
+    docs = {doc["tid"]: doc for doc in trials.trials}
+    domain = Domain(lambda x: None, space)
+    start = monotonic() - state["elapsed"]
+    initargs = (clazz, extra, x_train, y_train, x_dev, y_dev, w_train, w_dev, budget,
+                __quantiles(y_train) if fidelities > 1 else None)
+    if parallel == 1:
+        __setup(*initargs)
+    if cache is not None:
+        makedirs(cache, exist_ok=True)
+    running = {}
+    entries = {}
+    with ProcessPoolExecutor(parallel, initializer=__setup, initargs=initargs) if parallel > 1 else nullcontext() \
+            as executor:
+        while True:
+            while state["stale"] < window_size and len(running) < parallel and monotonic() - start < timeout:
+                # The best trial that can be promoted, starting from the highest fidelity.
+                promoted = None
+                for rung in reversed(range(fidelities - 1)):
+                    ranked = sorted(rungs[rung], key=rungs[rung].get)[:len(rungs[rung]) // eta]
+                    ranked = [tid for tid in ranked if tid not in rungs[rung + 1] and (tid, rung + 1) not in
+                              running.values()]
+                    if ranked:
+                        promoted = ranked[0], rung + 1
+                        break
+                if promoted is not None:
+                    tid, rung = promoted
+                elif len(trials) < 1024:
+                    trials.refresh()
+                    trials.insert_trial_docs(tpe.suggest(trials.new_trial_ids(1), domain, trials,
+                                                         state["random"].integers(2 ** 31 - 1)))
+                    trials.refresh()
+                    doc = trials.trials[-1]
+                    doc["state"] = JOB_STATE_RUNNING
+                    doc["book_time"] = coarse_utcnow()
+                    tid, rung = doc["tid"], 0
+                    docs[tid] = doc
+                else:
+                    break
+                hyperparameters = space_eval(space, spec_from_misc(docs[tid]["misc"]))
+                fidelity = float(eta) ** (rung - fidelities + 1)
+                # The losses already computed are identified by the data, the classifier and the fidelity.
+                entry = None if cache is None else "%s/%s.joblib" % (cache, __key(fingerprint, clazz, extra,
+                                                                                   hyperparameters, fidelity))
+                if entry is not None and exists(entry):
+                    future = Future()
+                    future.set_result(load(entry))
+                    entry = None
+                elif executor is None:
+                    future = Future()
+                    future.set_result(__trial(hyperparameters, fidelity))
+                else:
+                    future = executor.submit(__trial, hyperparameters, fidelity)
+                running[future] = tid, rung
+                entries[future] = entry
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                tid, rung = running.pop(future)
+                loss = future.result()
+                entry = entries.pop(future)
+                if entry is not None:
+                    dump(loss, "%s.%d.tmp" % (entry, getpid()))
+                    replace("%s.%d.tmp" % (entry, getpid()), entry)
+                rungs[rung][tid] = loss
+                doc = docs[tid]
+                doc["state"] = JOB_STATE_DONE
+                doc["result"] = {"loss": loss, "status": STATUS_OK}
+                doc["refresh_time"] = coarse_utcnow()
+                trials.refresh()
+                if rung == fidelities - 1:
+                    if state["best"] is None or loss < state["best"]:
+                        state["best"] = loss
+                        state["stale"] = 0
+                    else:
+                        state["stale"] += 1
+                if fidelities > 1:
+                    print("trial %d, fidelity %d: MCC %.4f (best %.4f)" % (tid, rung, -loss,
+                                                                           -(state["best"] or 0)))
+                else:
+                    print("trial %d: MCC %.4f (best %.4f)" % (tid, -loss, -state["best"]))
+                state["elapsed"] = monotonic() - start
+                dump(state, "%s.tmp" % checkpoint)
+                replace("%s.tmp" % checkpoint, checkpoint)
+    _worker.clear()
+
+    # The best trial at the highest fidelity reached by a trial.
+    rung = max(rung for rung in range(fidelities) if rungs[rung])
+    best = min(rungs[rung], key=rungs[rung].get)
+
+    return spec_from_misc(docs[best]["misc"]), trials
 
 
 def optimize(name: str, path: str, clazz: Type[ClassifierMixin], extra: Dict[Any, Any], space: Dict[str, Any],
              x_train: DataFrame, y_train: DataFrame, x_dev: DataFrame, y_dev: DataFrame, numbers: bool,
-             scaler: StandardScaler, timeout: int, window_size: int) -> None:
+             scaler: StandardScaler, timeout: int, window_size: int, w_train: Optional[Series] = None,
+             w_dev: Optional[Series] = None, parallel: Optional[int] = 1, budget: Optional[str] = None,
+             fidelities: int = 1, eta: int = 3, cache: Optional[str] = None) -> None:
     """
-    Trains a single generic classifier by performing a Bayesian optimization search and saves it to file.
+    Trains a single generic classifier by performing a Bayesian optimization search and saves it to file. The search
+    is checkpointed to a .search file next to the classifier, and an interrupted search is resumed by the next call.
 
     :param name: a good name for the classifier
     :param path: the file name for the saved classifier
@@ -85,10 +411,20 @@ def optimize(name: str, path: str, clazz: Type[ClassifierMixin], extra: Dict[Any
     :param numbers: indicates if this classifier can only handle number
     :param timeout: the timeout in seconds
     :param window_size: the window size for the stability check
+    :param w_train: the training sample weights or None
+    :param w_dev: the development sample weights or None
+    :param parallel: the number of trials evaluated at once on a pool of processes, sharing the cores of n_jobs, or None
+                     to evaluate a trial every 4 cores
+    :param budget: the hyper-parameter or the extra class parameter reduced at the lower fidelities, such as the number
+                   of trees or of epochs, or None
+    :param fidelities: the number of fidelities of the successive halving, 1 for evaluating every trial at full fidelity
+    :param eta: the ratio between two consecutive fidelities
+    :param cache: the folder for the cache of the losses, shared by all the classifiers, or None
     """
 
     if not exists(path):
         print(Fore.RED + ("%s" % name).upper() + Style.RESET_ALL)
+        classes = list(y_train.cat.categories)
 
         print("scaling...")
         # noinspection PyUnresolvedReferences
@@ -101,21 +437,30 @@ def optimize(name: str, path: str, clazz: Type[ClassifierMixin], extra: Dict[Any
             y_train = y_train.cat.codes.astype(int64)
             y_dev = y_dev.cat.codes.astype(int64)
 
+        if w_train is not None:
+            w_train = w_train.to_numpy()
+        if w_dev is not None:
+            w_dev = w_dev.to_numpy()
+
         print("optimizing...")
-        trials = Trials()
-        best = fmin(fn=lambda x: __evaluate(clazz, extra, x, x_train, y_train, x_dev, y_dev), space=space,
-                    algo=tpe.suggest, timeout=timeout, max_evals=1024, trials=trials,
-                    early_stop_fn=no_progress_loss(iteration_stop_count=window_size))
+        if parallel is None:
+            parallel = max(cpu_count() // 4, 1)
+        # The search is saved next to the model until the model is saved, so that an interrupted one is resumed.
+        best, trials = __search(clazz, extra, space, x_train, y_train, x_dev, y_dev, w_train, w_dev, timeout,
+                                window_size, parallel, "%s.search" % path, budget, fidelities, eta, cache)
 
         print("training the final classifier...")
-        classifier = __train(clazz, extra, space_eval(space, best), x_train, y_train)
+        classifier = __train(clazz, extra, space_eval(space, best), x_train, y_train, w_train)
 
         print("saving to %s..." % path)
         data = {
                 "name":       name,
+                "classes":    classes,
                 "classifier": classifier,
                 "numbers":    numbers,
                 "scaler":     scaler,
                 "trials":     trials
         }
-        dump(data, path, compress=9)
+        dump(data, "%s.tmp" % path, compress=9)
+        replace("%s.tmp" % path, path)
+        remove("%s.search" % path)
@@ -0,0 +1,378 @@
+"""
+Inference server functions.
+"""
+from asyncio import Condition
+from asyncio import Event
+from asyncio import Future
+from asyncio import IncompleteReadError
+from asyncio import LimitOverrunError
+from asyncio import StreamReader
+from asyncio import StreamWriter
+from asyncio import TimeoutError
+from asyncio import ensure_future
+from asyncio import get_event_loop
+from asyncio import start_server
+from asyncio import start_unix_server
+from asyncio import wait_for
+from collections import deque
+from json import dumps
+from json import loads
+from time import monotonic
+from typing import Any
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from numpy import array
+from numpy import errstate
+from numpy import float32
+from numpy import isfinite
+from numpy import ndarray
+from numpy import percentile
+from numpy import vstack
+
+from .classification import flat_forest
+from .classification import probabilities
+
+_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed because the queue of a model is full.
+    """
+
+
+class Failed(Exception):
+    """
+    Raised when the batch of a request cannot be classified.
+    """
+
+
+class TooLarge(Exception):
+    """
+    Raised when a request contains more flows than the queue of a model can ever hold, so retrying it is pointless.
+    """
+
+
+class Batcher:
+    """
+    Coalesces the concurrent classification requests of a model into batches, so that the scaler and the classifier
+    are invoked once for many flows. A batch is classified when it reaches the maximum size or its oldest request has
+    waited for the maximum time. The queued flows are bounded: a request that does not fit waits for some room for a
+    limited time (backpressure) and it is then rejected (load shedding).
+    """
+
+    def __init__(self, model: Dict[str, Any], classes: Sequence[str], max_batch: int = 1024, max_wait: float = 0.005,
+                 max_queue: int = 65536, queue_timeout: float = 0.1, window: int = 10000, step: Optional[int] = None,
+                 tolerance: float = 0):
+        """
+        Creates the batcher.
+
+        :param model: the model to use, as saved by optimize()
+        :param classes: the class names, in the order of the classifier outputs
+        :param max_batch: the maximum number of flows classified at once
+        :param max_wait: the maximum seconds a request waits for other requests to fill a batch
+        :param max_queue: the maximum number of flows waiting or being classified
+        :param queue_timeout: the maximum seconds a request waits for some room in the queue before being rejected
+        :param window: the number of recent requests used for the latency percentiles
+        :param step: the number of trees evaluated at a time by the early exit of a forest or None to evaluate them all
+        :param tolerance: the maximum probability that the early exit changes the class of a flow
+        """
+
+        self.__model = model
+        self.labels = [str(i) for i in classes]
+        self.__max_batch = max_batch
+        self.__max_wait = max_wait
+        self.__max_queue = max_queue
+        self.__queue_timeout = queue_timeout
+        self.__step = step
+        self.__tolerance = tolerance
+        if step is not None:
+            flat_forest(model)
+
+        self.__pending: Deque[Tuple[ndarray, Future, float]] = deque()
+        self.__waiting = 0
+        self.__queued = 0
+        self.__arrived = Event()
+        self.__room = Condition()
+
+        self.__start = monotonic()
+        self.__latencies: Deque[float] = deque(maxlen=window)
+        self.__completions: Deque[Tuple[float, int]] = deque()
+        self.__requests = 0
+        self.__flows = 0
+        self.__batches = 0
+        self.__rejected = 0
+
+    async def classify(self, x: ndarray) -> Tuple[List[str], ndarray]:
+        """
+        Classifies some flows.
+
+        :param x: the input features of the flows
+        :return: a tuple where the first element is the classes and the second the probabilities
+        """
+
+        begin = monotonic()
+        count = len(x)
+        if count > self.__max_queue:
+            raise TooLarge("at most %d flows per request" % self.__max_queue)
+        future = get_event_loop().create_future()
+        async with self.__room:
+            # The room is checked again after every wake-up, since the requests woken at once may not all fit, and the
+            # request is queued while holding the condition, so that no other request takes the same room.
+            deadline = begin + self.__queue_timeout
+            while self.__queued + count > self.__max_queue:
+                try:
+                    if monotonic() >= deadline:
+                        raise TimeoutError()
+                    await wait_for(self.__room.wait(), deadline - monotonic())
+                except TimeoutError:
+                    self.__rejected += 1
+                    raise Overloaded()
+            self.__pending.append((x, future, begin))
+            self.__waiting += count
+            self.__queued += count
+            self.__arrived.set()
+        result = await future
+        self.__latencies.append(monotonic() - begin)
+
+        return result
+
+    def __predict(self, x: ndarray) -> Tuple[List[str], ndarray]:
+        """
+        Classifies a batch.
+
+        :param x: the input features of the flows
+        :return: a tuple where the first element is the classes and the second the probabilities
+        """
+
+        x = self.__model["scaler"].transform(x)
+        if self.__step is None:
+            p = probabilities(self.__model, x)
+        else:
+            p = flat_forest(self.__model).predict_proba_early(x, self.__step, self.__tolerance)[0]
+
+        return [self.labels[i] for i in p.argmax(axis=1)], p
+
+    async def run(self) -> None:
+        """
+        Classifies the batches forever.
+        """
+
+        loop = get_event_loop()
+        while True:
+            while not self.__pending:
+                self.__arrived.clear()
+                await self.__arrived.wait()
+
+            # Waits for more requests until the batch is full or the oldest request has waited enough.
+            deadline = self.__pending[0][2] + self.__max_wait
+            while self.__waiting < self.__max_batch and monotonic() < deadline:
+                self.__arrived.clear()
+                try:
+                    await wait_for(self.__arrived.wait(), deadline - monotonic())
+                except TimeoutError:
+                    break
+
+            batch = [self.__pending.popleft()]
+            size = len(batch[0][0])
+            while self.__pending and size + len(self.__pending[0][0]) <= self.__max_batch:
+                batch.append(self.__pending.popleft())
+                size += len(batch[-1][0])
+            self.__waiting -= size
+
+            try:
+                classes, p = await loop.run_in_executor(None, self.__predict, vstack([i[0] for i in batch]))
+                start = 0
+                for x, future, _ in batch:
+                    if not future.done():
+                        future.set_result((classes[start:start + len(x)], p[start:start + len(x)]))
+                    start += len(x)
+            except Exception as e:
+                # The error is reported to every request of the batch, which would otherwise never be answered.
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(Failed("%s: %s" % (type(e).__name__, e)))
+
+            self.__queued -= size
+            self.__requests += len(batch)
+            self.__flows += size
+            self.__batches += 1
+            self.__completions.append((monotonic(), size))
+            async with self.__room:
+                self.__room.notify_all()
+
+    def metrics(self, period: float = 60) -> Dict[str, Any]:
+        """
+        Computes the metrics of the batcher.
+
+        :param period: the most recent seconds used for computing the throughput
+        :return: the throughput in flows per second, the 50th and 99th latency percentiles in milliseconds, the queue
+                 depth in flows and some counters
+        """
+
+        now = monotonic()
+        while self.__completions and self.__completions[0][0] < now - period:
+            self.__completions.popleft()
+        latencies = array(self.__latencies) * 1000 if self.__latencies else array([0.0])
+
+        return {
+                "throughput":  sum(i for _, i in self.__completions) / max(min(period, now - self.__start), 1e-3),
+                "p50":         float(percentile(latencies, 50)),
+                "p99":         float(percentile(latencies, 99)),
+                "queue_depth": self.__queued,
+                "requests":    self.__requests,
+                "flows":       self.__flows,
+                "batches":     self.__batches,
+                "mean_batch":  self.__flows / self.__batches if self.__batches > 0 else 0,
+                "rejected":    self.__rejected
+        }
+
+
+class InferenceServer:
+    """
+    A minimal HTTP/1.1 server exposing some batchers, on a localhost port or a Unix socket. The endpoints are:
+
+    + POST /classify/<model>, with a JSON body containing either "flows", a list of objects mapping the feature names to
+      their values, or "features", a list of lists of values in the order of the features, answered with the class
+      labels of the model, the class of every flow and their probabilities;
+    + GET /metrics, answered with the metrics of every model;
+    + GET /models, answered with the model names and their class labels.
+
+    The requests rejected because of an overload are answered with a 503 status, while the requests with more flows than
+    the queue of a model are answered with a 413 status. The features must be finite, and a batch that cannot be
+    classified answers all its requests with a 500 status.
+    """
+
+    def __init__(self, batchers: Dict[str, Batcher], features: Sequence[str]):
+        """
+        Creates the server.
+
+        :param batchers: the batchers of the models, indexed by name
+        :param features: the input features
+        """
+
+        self.__batchers = batchers
+        self.__features = list(features)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """
+        Serves the requests forever on a TCP port.
+
+        :param host: the address to listen on
+        :param port: the port to listen on
+        """
+
+        for batcher in self.__batchers.values():
+            ensure_future(batcher.run())
+        server = await start_server(self.__handle, host, port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_unix(self, path: str) -> None:
+        """
+        Serves the requests forever on a Unix socket.
+
+        :param path: the name of the socket
+        """
+
+        for batcher in self.__batchers.values():
+            ensure_future(batcher.run())
+        server = await start_unix_server(self.__handle, path, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    async def __answer(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        """
+        Answers a request.
+
+        :param method: the request method
+        :param path: the request path
+        :param body: the request body
+        :return: a tuple with the status code and the response object
+        """
+
+        if path == "/metrics":
+            return 200, {k: v.metrics() for k, v in self.__batchers.items()}
+        elif path == "/models":
+            return 200, {k: v.labels for k, v in self.__batchers.items()}
+        elif not path.startswith("/classify/"):
+            return 404, {"error": "unknown path"}
+        elif path[10:] not in self.__batchers:
+            return 404, {"error": "unknown model"}
+        elif method != "POST":
+            return 405, {"error": "use POST"}
+
+        batcher = self.__batchers[path[10:]]
+        try:
+            request = loads(body)
+            # The values too large for a 32-bit float become infinite, and they are rejected below.
+            with errstate(over="ignore"):
+                if "flows" in request:
+                    x = array([[i[f] for f in self.__features] for i in request["flows"]], dtype=float32)
+                else:
+                    x = array(request["features"], dtype=float32)
+            if len(x) == 0:
+                return 200, {"labels": batcher.labels, "classes": [], "probabilities": []}
+            if x.ndim != 2 or x.shape[1] != len(self.__features):
+                raise ValueError("%d features expected" % len(self.__features))
+            # A single non-finite value would fail the whole batch.
+            if not isfinite(x).all():
+                raise ValueError("the features must be finite")
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": "invalid request: %s" % e}
+
+        try:
+            classes, p = await batcher.classify(x)
+        except TooLarge as e:
+            return 413, {"error": "too many flows: %s" % e}
+        except Overloaded:
+            return 503, {"error": "overloaded"}
+        except Failed as e:
+            return 500, {"error": "classification failed: %s" % e}
+
+        return 200, {"labels": batcher.labels, "classes": classes, "probabilities": p.tolist()}
+
+    async def __handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Handles a connection.
+
+        :param reader: the connection reader
+        :param writer: the connection writer
+        """
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                if len(parts) != 3:
+                    status, response = 400, {"error": "invalid request line"}
+                    keep_alive = False
+                else:
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" if parts[2] == "HTTP/1.0" else connection != "close"
+                    status, response = await self.__answer(parts[0], parts[1].split("?")[0], body)
+
+                content = dumps(response).encode()
+                head = ["HTTP/1.1 %d %s" % (status, _reasons[status]), "Content-Type: application/json",
+                        "Content-Length: %d" % len(content),
+                        "Connection: %s" % ("keep-alive" if keep_alive else "close")]
+                if status == 503:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + content)
+                await writer.drain()
+        except (ConnectionError, IncompleteReadError, LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,173 @@
+"""
+Model storage functions.
+"""
+from io import BytesIO
+from mmap import ACCESS_READ
+from mmap import ALLOCATIONGRANULARITY
+from mmap import mmap
+from os import replace
+from pickle import HIGHEST_PROTOCOL
+from pickle import Pickler
+from pickle import Unpickler
+from struct import pack
+from struct import unpack
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from joblib import load
+from numpy import memmap
+from numpy import ndarray
+
+# The first bytes of the memory-mappable models, followed by the offset and the length of the pickled model.
+_magic = b"FPMODEL1"
+_header = "<QQ"
+
+
+class __ArrayPickler(Pickler):
+    """
+    A pickler storing the arrays outside of the pickled objects, each one at a page-aligned offset of the file. An
+    object can also be deferred, i.e. pickled in its own section of the file, so that it can be skipped when loading.
+    """
+
+    def __init__(self, file: BinaryIO, output: BinaryIO, deferred: Any = None):
+        """
+        Creates the pickler.
+
+        :param file: the file where the arrays are written
+        :param output: the stream where the pickled objects are written
+        :param deferred: the object to pickle in its own section or None
+        """
+
+        super().__init__(output, HIGHEST_PROTOCOL)
+        self.__file = file
+        self.__deferred = deferred
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[Any, ...]]:
+        """
+        Stores an array or the deferred object in the file.
+
+        :param obj: the object to pickle
+        :return: the offset, the type, the shape and the order of an array, the offset and the length of the deferred
+                 object or None to pickle the object normally
+        """
+
+        if self.__deferred is not None and obj is self.__deferred:
+            output = BytesIO()
+            type(self)(self.__file, output).dump(obj)
+            self.__file.seek(0, 2)
+            offset = self.__file.tell()
+            self.__file.write(output.getbuffer())
+            return offset, output.tell()
+
+        if type(obj) not in (ndarray, memmap) or obj.dtype.hasobject or obj.nbytes == 0:
+            return None
+
+        order = "F" if obj.flags.f_contiguous and not obj.flags.c_contiguous else "C"
+        offset = -self.__file.tell() % ALLOCATIONGRANULARITY + self.__file.tell()
+        self.__file.seek(offset)
+        self.__file.write(obj.tobytes(order=order))
+
+        return offset, obj.dtype, obj.shape, order
+
+
+class __ArrayUnpickler(Unpickler):
+    """
+    An unpickler restoring the arrays stored outside of the pickled objects as views of the file contents.
+    """
+
+    def __init__(self, data: BinaryIO, buffer: Union[mmap, bytearray], deferred: bool = True):
+        """
+        Creates the unpickler.
+
+        :param data: the stream of the pickled objects
+        :param buffer: the contents of the file
+        :param deferred: True to restore the deferred object, False to replace it with None
+        """
+
+        super().__init__(data)
+        self.__buffer = buffer
+        self.__deferred = deferred
+
+    def persistent_load(self, pid: Tuple[Any, ...]) -> Any:
+        """
+        Restores an array or the deferred object.
+
+        :param pid: the offset, the type, the shape and the order of an array or the offset and the length of the
+                    deferred object
+        :return: the array or the deferred object
+        """
+
+        if len(pid) == 2:
+            offset, length = pid
+            if not self.__deferred:
+                return None
+            return type(self)(BytesIO(self.__buffer[offset:offset + length]), self.__buffer).load()
+
+        offset, dtype, shape, order = pid
+
+        return ndarray(shape, dtype, buffer=self.__buffer, offset=offset, order=order)
+
+
+def save_model(model: Dict[str, Any], path: str) -> None:
+    """
+    Saves a model in the memory-mappable format: the arrays, such as the nodes of the trees or the parameters of the
+    scaler, are stored uncompressed and page-aligned, followed by the other pickled objects. When the model has a flat
+    forest, the classifier is stored in its own section, so that it can be skipped by `load_model()`.
+
+    :param model: the model to save
+    :param path: the name of the file
+    """
+
+    with open("%s.tmp" % path, "wb") as file:
+        # The header is written last, once the arrays have been written.
+        file.write(b"\0" * ALLOCATIONGRANULARITY)
+        output = BytesIO()
+        __ArrayPickler(file, output, model["classifier"] if "flat" in model else None).dump(model)
+        file.seek(0, 2)
+        offset = file.tell()
+        file.write(output.getbuffer())
+        file.seek(0)
+        file.write(_magic + pack(_header, offset, output.tell()))
+    replace("%s.tmp" % path, path)
+
+
+def packed(path: str) -> bool:
+    """
+    Checks if a model is in the memory-mappable format.
+
+    :param path: the name of the file
+    :return: True if the model is in the memory-mappable format, False if it has been saved with joblib
+    """
+
+    with open(path, "rb") as file:
+        return file.read(len(_magic)) == _magic
+
+
+def load_model(path: str, mapped: bool = True, estimators: bool = True) -> Dict[str, Any]:
+    """
+    Loads a model, either in the memory-mappable format or saved with joblib. The arrays of a memory-mapped model are
+    read-only and shared by all the processes mapping the same file, but the classes copying them when unpickled, such
+    as the scikit-learn trees, keep a private copy. A memory-mappable model with a flat forest can thus be loaded
+    without its classifier, replaced by the flat forest, so that its trees exist only once, in the shared file.
+
+    :param path: the name of the file
+    :param mapped: True to map the arrays of a memory-mappable model, False to read them in memory
+    :param estimators: True to load the classifier, False to replace it with the flat forest when possible
+    :return: the model
+    """
+
+    if not packed(path):
+        return load(path)
+
+    with open(path, "rb") as file:
+        buffer = mmap(file.fileno(), 0, access=ACCESS_READ) if mapped else bytearray(file.read())
+    offset, length = unpack(_header, buffer[len(_magic):len(_magic) + 16])
+    model = __ArrayUnpickler(BytesIO(buffer[offset:offset + length]), buffer, estimators).load()
+    if model["classifier"] is None:
+        model["classifier"] = model["flat"]
+
+    return model
@@ -0,0 +1,275 @@
+"""
+Streaming classification functions.
+"""
+from json import dumps
+from os import fstat
+from os import listdir
+from os import stat
+from os.path import exists
+from os.path import isdir
+from time import monotonic
+from time import sleep
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import TextIO
+
+from numpy import float32
+from pandas import DataFrame
+from pandas import concat
+
+from .classification import classify
+from .classification import classify_early
+from .classification import flat_forest
+
+
+def parse_header(line: str) -> List[str]:
+    """
+    Parses the header of a tstat log, e.g. "#15#c_ip:1 c_port:2 ...".
+
+    :param line: the header line
+    :return: the column names
+    """
+
+    return [i.split(":")[0].split("#")[-1] for i in line.strip().split()]
+
+
+class LogFollower:
+    """
+    Follows a tstat log file as it grows, like `tail -F`: the file may not exist yet, and it is reopened from the start
+    when it is replaced or truncated. The rows still unread in a replaced file are read before reopening it.
+    """
+
+    def __init__(self, path: str, from_end: bool = False):
+        """
+        Creates the follower.
+
+        :param path: the name of the log file
+        :param from_end: True to skip the rows already in the file when it is first opened
+        """
+
+        self.__path = path
+        self.__from_end = from_end
+        self.__file: Optional[BinaryIO] = None
+        self.__buffer = b""
+        self.__columns: List[str] = []
+
+    def close(self) -> None:
+        """
+        Closes the log file.
+        """
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__buffer = b""
+
+    def __parse(self, data: bytes) -> DataFrame:
+        """
+        Parses the bytes read from the log file. The incomplete last line is kept until its end is written.
+
+        :param data: the bytes read
+        :return: the rows, with the column names found in the header of the log and the values as strings
+        """
+
+        lines = (self.__buffer + data).split(b"\n")
+        self.__buffer = lines.pop()
+        rows = []
+        for line in lines:
+            if line.startswith(b"#"):
+                self.__columns = parse_header(line.decode())
+            elif line.strip():
+                rows.append(line.decode().split()[:len(self.__columns)])
+
+        return DataFrame(rows, columns=self.__columns[:len(rows[0])] if rows else None)
+
+    def read(self) -> DataFrame:
+        """
+        Reads the rows appended since the last call. Incomplete lines are kept until their end is written.
+
+        :return: the new rows, with the column names found in the header of the log and the values as strings
+        """
+
+        parts = []
+        if self.__file is not None:
+            try:
+                replaced = stat(self.__path).st_ino != fstat(self.__file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            if replaced:
+                # The rows written to the old file before it was replaced are read to its end.
+                parts.append(self.__parse(self.__file.read()))
+            if replaced or fstat(self.__file.fileno()).st_size < self.__file.tell():
+                self.close()
+                self.__from_end = False
+        if self.__file is None and exists(self.__path):
+            self.__file = open(self.__path, "rb")
+            if self.__from_end:
+                header = self.__file.readline()
+                if header.endswith(b"\n"):
+                    self.__columns = parse_header(header.decode())
+                    self.__file.seek(0, 2)
+                else:
+                    self.__file.seek(0)
+        if self.__file is not None:
+            parts.append(self.__parse(self.__file.read()))
+        parts = [i for i in parts if len(i) > 0]
+
+        return concat(parts, ignore_index=True) if parts else DataFrame()
+
+
+class TstatFollower:
+    """
+    Follows the log_tcp_complete and log_tcp_nocomplete files written by tstat during a live capture. The folder can
+    either directly contain the logs or be the tstat output folder, in which case the logs of its most recent
+    sub-folder are followed, switching to the new one when tstat rotates its output.
+    """
+
+    def __init__(self, folder: str, from_end: bool = False):
+        """
+        Creates the follower.
+
+        :param folder: the name of the log folder or of the tstat output folder
+        :param from_end: True to skip the flows already logged when the logs are first opened
+        """
+
+        self.__folder = folder
+        self.__from_end = from_end
+        self.__current: Optional[str] = None
+        self.__followers: List[LogFollower] = []
+
+    def __latest(self) -> Optional[str]:
+        """
+        Finds the folder containing the most recent logs.
+
+        :return: the folder or None if there are no logs yet
+        """
+
+        if exists("%s/log_tcp_complete" % self.__folder) or not isdir(self.__folder):
+            return self.__folder
+        folders = sorted(i for i in listdir(self.__folder) if isdir("%s/%s" % (self.__folder, i)))
+
+        return "%s/%s" % (self.__folder, folders[-1]) if folders else None
+
+    def read(self) -> DataFrame:
+        """
+        Reads the flows logged since the last call.
+
+        :return: the new flows, with the tstat columns as strings and the boolean complete column
+        """
+
+        parts = []
+        latest = self.__latest()
+        if latest is None:
+            return DataFrame()
+        if latest != self.__current:
+            # The remaining flows of the old logs are read before switching to the new ones.
+            for follower, complete in zip(self.__followers, [True, False]):
+                parts.append(follower.read().assign(complete=complete))
+                follower.close()
+            self.__followers = [LogFollower("%s/%s" % (latest, i), self.__from_end and self.__current is None)
+                                for i in ["log_tcp_complete", "log_tcp_nocomplete"]]
+            self.__current = latest
+        for follower, complete in zip(self.__followers, [True, False]):
+            parts.append(follower.read().assign(complete=complete))
+
+        parts = [i for i in parts if len(i) > 0]
+
+        return concat(parts, ignore_index=True) if parts else DataFrame()
+
+
+def classify_stream(model: Dict[str, Any], follower: TstatFollower, features: Sequence[str], classes: Dict[int, str],
+                    output: TextIO, latency: float = 1, batch_size: int = 4096, poll: float = 0.1,
+                    probabilities: bool = False, step: Optional[int] = None, tolerance: float = 0) -> None:
+    """
+    Classifies the flows logged by tstat in micro-batches and writes a JSON line with the verdict of every flow, until
+    interrupted. A batch is classified as soon as it reaches the maximum size or its oldest flow is about to exceed the
+    latency target, taking into account the time needed for classifying a batch. The latency is measured from the time
+    a flow is read, so the flows can wait up to an additional polling interval in the logs.
+
+    :param model: the model to use
+    :param follower: the follower of the tstat logs
+    :param features: the input features
+    :param classes: the dict for decoding the outputs
+    :param output: the output file
+    :param latency: the target seconds between reading a flow and writing its verdict
+    :param batch_size: the maximum number of flows to classify at once
+    :param poll: the seconds between two reads of the logs
+    :param probabilities: True to also write the probabilities of all the classes
+    :param step: the number of trees evaluated at a time by the early exit of a forest or None to evaluate them all
+    :param tolerance: the maximum probability that the early exit changes the class of a flow
+    """
+
+    if step is not None:
+        flat_forest(model)
+    pending: List[DataFrame] = []
+    count = 0
+    oldest = None
+    # A moving average of the seconds needed for classifying a batch.
+    cost = 0.0
+
+    try:
+        while True:
+            flows = follower.read()
+            now = monotonic()
+            if len(flows) > 0:
+                pending.append(flows)
+                count += len(flows)
+                if oldest is None:
+                    oldest = now
+
+            if count > 0 and (count >= batch_size or now - oldest + cost >= latency):
+                flows = concat(pending, ignore_index=True)
+                while len(flows) > 0:
+                    # The flows stay pending until written, so that none is lost when interrupted.
+                    pending = [flows]
+                    begin = monotonic()
+                    __emit(model, flows.iloc[:batch_size], features, classes, output, probabilities, step, tolerance)
+                    cost = 0.8 * cost + 0.2 * (monotonic() - begin)
+                    flows = flows.iloc[batch_size:]
+                pending = []
+                count = 0
+                oldest = None
+            elif oldest is None:
+                sleep(poll)
+            else:
+                sleep(max(min(poll, latency - cost - (now - oldest)), 0))
+    except KeyboardInterrupt:
+        if pending:
+            __emit(model, concat(pending, ignore_index=True), features, classes, output, probabilities, step,
+                   tolerance)
+
+
+def __emit(model: Dict[str, Any], flows: DataFrame, features: Sequence[str], classes: Dict[int, str], output: TextIO,
+           probabilities: bool, step: Optional[int], tolerance: float) -> None:
+    """
+    Classifies a batch of flows and writes their verdicts.
+
+    :param model: the model to use
+    :param flows: the flows
+    :param features: the input features
+    :param classes: the dict for decoding the outputs
+    :param output: the output file
+    :param probabilities: True to also write the probabilities of all the classes
+    :param step: the number of trees evaluated at a time by the early exit or None to evaluate them all
+    :param tolerance: the maximum probability that the early exit changes the class of a flow
+    """
+
+    x = flows.loc[:, features].astype(float32)
+    if step is None:
+        yy, p = classify(model, x, classes)
+    else:
+        yy, p, _ = classify_early(model, x, classes, step, tolerance)
+    confidence = p.to_numpy().max(axis=1)
+    p = p.to_dict("records") if probabilities else None
+    for i, (c_ip, c_port, s_ip, s_port, first, complete) in enumerate(
+            flows.loc[:, ["c_ip", "c_port", "s_ip", "s_port", "first", "complete"]].itertuples(index=False)):
+        verdict = {"c_ip": c_ip, "c_port": int(c_port), "s_ip": s_ip, "s_port": int(s_port), "first": float(first),
+                   "complete": bool(complete), "class": str(yy.iloc[i]), "probability": float(confidence[i])}
+        if p is not None:
+            verdict["probabilities"] = {str(k): float(v) for k, v in p[i].items()}
+        print(dumps(verdict), file=output)
+    output.flush()
@@ -4,6 +4,7 @@ UI functions.
 
 from typing import Any
 from typing import Dict
+from typing import Optional
 from typing import TextIO
 
 from pandas import DataFrame
@@ -22,7 +23,8 @@ from sklearn.metrics import recall_score
 from sklearn.metrics import zero_one_loss
 
 
-def print_data_set(tex: TextIO, tag: str, description: str, data_set: DataFrame, group: str) -> None:
+def print_data_set(tex: TextIO, tag: str, description: str, data_set: DataFrame, group: str,
+                   weights: Optional[Series] = None) -> None:
     """
     Prints some statistics about a dataset.
 
@@ -31,9 +33,14 @@ def print_data_set(tex: TextIO, tag: str, description: str, data_set: DataFrame,
     :param description: a description for the caption
     :param data_set: the data set to analyze
     :param group: the feature name for grouping the data
+    :param weights: the sample weights or None
     """
     features = ["c_pkts_all", "c_bytes_all", "s_pkts_all", "s_bytes_all", "durat"]
-    means = data_set[[group, *features]].groupby(group).mean()
+    if weights is None:
+        means = data_set[[group, *features]].groupby(group).mean()
+    else:
+        sums = data_set[features].multiply(weights, axis=0).groupby(data_set[group]).sum()
+        means = sums.divide(weights.groupby(data_set[group]).sum(), axis=0)
     print("\\begin{table}[H]", file=tex)
     print("\t\\centering", file=tex)
     print("\t\\begin{tabular}{lrrrrr}", file=tex)
@@ -120,7 +127,9 @@ def print_hyperparameters(tex: TextIO, tag: str, description: str, model: Dict[s
 
 
 def print_statistics(tex: TextIO, tag: str, description: str, train_y: Series, train_yy: Series, dev_y: Series,
-                     dev_yy: Series, known_y: Series, known_yy: Series, unknown_y: Series, unknown_yy: Series) -> None:
+                     dev_yy: Series, known_y: Series, known_yy: Series, unknown_y: Series, unknown_yy: Series,
+                     train_w: Optional[Series] = None, dev_w: Optional[Series] = None,
+                     known_w: Optional[Series] = None, unknown_w: Optional[Series] = None) -> None:
     """
     Prints some classification statistics.
 
@@ -135,8 +144,15 @@ def print_statistics(tex: TextIO, tag: str, description: str, train_y: Series, t
     :param known_yy: the known set inferred classes
     :param unknown_y: the unknown set target classes
     :param unknown_yy: the unknown set inferred classes
+    :param train_w: the training set sample weights or None
+    :param dev_w: the development set sample weights or None
+    :param known_w: the known set sample weights or None
+    :param unknown_w: the unknown set sample weights or None
     """
 
+    samples = [len(y) if w is None else w.sum() for y, w in
+               [(train_y, train_w), (dev_y, dev_w), (known_y, known_w), (unknown_y, unknown_w)]]
+
     print("\\begin{table}[H]", file=tex)
     print("\t\\centering", file=tex)
     print("\t\\begin{tabular}{lrrrr}", file=tex)
@@ -144,57 +160,57 @@ def print_statistics(tex: TextIO, tag: str, description: str, train_y: Series, t
     print("\t\t\\textsc{statistic} & \\textsc{training set} & \\textsc{dev set} & \\textsc{kts} & \\textsc{uts}\\\\",
           file=tex)
     print("\t\t\\midrule", file=tex)
-    print("\t\tsamples & %d & %d & %d & %d\\\\" % (len(train_y), len(dev_y), len(known_y), len(unknown_y)), file=tex)
+    print("\t\tsamples & %d & %d & %d & %d\\\\" % tuple(samples), file=tex)
     print("\t\taccuracy [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            accuracy_score(train_y, train_yy) * 100,
-            accuracy_score(dev_y, dev_yy) * 100,
-            accuracy_score(known_y, known_yy) * 100,
-            accuracy_score(unknown_y, unknown_yy) * 100), file=tex)
+            accuracy_score(train_y, train_yy, sample_weight=train_w) * 100,
+            accuracy_score(dev_y, dev_yy, sample_weight=dev_w) * 100,
+            accuracy_score(known_y, known_yy, sample_weight=known_w) * 100,
+            accuracy_score(unknown_y, unknown_yy, sample_weight=unknown_w) * 100), file=tex)
     print("\t\tbalanced accuracy [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            balanced_accuracy_score(train_y, train_yy) * 100,
-            balanced_accuracy_score(dev_y, dev_yy) * 100,
-            balanced_accuracy_score(known_y, known_yy) * 100,
-            balanced_accuracy_score(unknown_y, unknown_yy) * 100), file=tex)
+            balanced_accuracy_score(train_y, train_yy, sample_weight=train_w) * 100,
+            balanced_accuracy_score(dev_y, dev_yy, sample_weight=dev_w) * 100,
+            balanced_accuracy_score(known_y, known_yy, sample_weight=known_w) * 100,
+            balanced_accuracy_score(unknown_y, unknown_yy, sample_weight=unknown_w) * 100), file=tex)
     print("\t\tprecision [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            precision_score(train_y, train_yy, average="macro") * 100,
-            precision_score(dev_y, dev_yy, average="macro") * 100,
-            precision_score(known_y, known_yy, average="macro") * 100,
-            precision_score(unknown_y, unknown_yy, average="macro") * 100), file=tex)
+            precision_score(train_y, train_yy, average="macro", sample_weight=train_w) * 100,
+            precision_score(dev_y, dev_yy, average="macro", sample_weight=dev_w) * 100,
+            precision_score(known_y, known_yy, average="macro", sample_weight=known_w) * 100,
+            precision_score(unknown_y, unknown_yy, average="macro", sample_weight=unknown_w) * 100), file=tex)
     print("\t\trecall [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            recall_score(train_y, train_yy, average="macro") * 100,
-            recall_score(dev_y, dev_yy, average="macro") * 100,
-            recall_score(known_y, known_yy, average="macro") * 100,
-            recall_score(unknown_y, unknown_yy, average="macro") * 100), file=tex)
+            recall_score(train_y, train_yy, average="macro", sample_weight=train_w) * 100,
+            recall_score(dev_y, dev_yy, average="macro", sample_weight=dev_w) * 100,
+            recall_score(known_y, known_yy, average="macro", sample_weight=known_w) * 100,
+            recall_score(unknown_y, unknown_yy, average="macro", sample_weight=unknown_w) * 100), file=tex)
     print("\t\tCohen’s kappa [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            cohen_kappa_score(train_y, train_yy) * 100,
-            cohen_kappa_score(dev_y, dev_yy) * 100,
-            cohen_kappa_score(known_y, known_yy) * 100,
-            cohen_kappa_score(unknown_y, unknown_yy) * 100), file=tex)
+            cohen_kappa_score(train_y, train_yy, sample_weight=train_w) * 100,
+            cohen_kappa_score(dev_y, dev_yy, sample_weight=dev_w) * 100,
+            cohen_kappa_score(known_y, known_yy, sample_weight=known_w) * 100,
+            cohen_kappa_score(unknown_y, unknown_yy, sample_weight=unknown_w) * 100), file=tex)
     print("\t\tF-score [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            f1_score(train_y, train_yy, average="macro") * 100,
-            f1_score(dev_y, dev_yy, average="macro") * 100,
-            f1_score(known_y, known_yy, average="macro") * 100,
-            f1_score(unknown_y, unknown_yy, average="macro") * 100), file=tex)
+            f1_score(train_y, train_yy, average="macro", sample_weight=train_w) * 100,
+            f1_score(dev_y, dev_yy, average="macro", sample_weight=dev_w) * 100,
+            f1_score(known_y, known_yy, average="macro", sample_weight=known_w) * 100,
+            f1_score(unknown_y, unknown_yy, average="macro", sample_weight=unknown_w) * 100), file=tex)
     print("\t\tJaccard score [$\\%%$] & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            jaccard_score(train_y, train_yy, average="macro") * 100,
-            jaccard_score(dev_y, dev_yy, average="macro") * 100,
-            jaccard_score(known_y, known_yy, average="macro") * 100,
-            jaccard_score(unknown_y, unknown_yy, average="macro") * 100), file=tex)
+            jaccard_score(train_y, train_yy, average="macro", sample_weight=train_w) * 100,
+            jaccard_score(dev_y, dev_yy, average="macro", sample_weight=dev_w) * 100,
+            jaccard_score(known_y, known_yy, average="macro", sample_weight=known_w) * 100,
+            jaccard_score(unknown_y, unknown_yy, average="macro", sample_weight=unknown_w) * 100), file=tex)
     print("\t\tHamming loss & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            hamming_loss(train_y, train_yy),
-            hamming_loss(dev_y, dev_yy),
-            hamming_loss(known_y, known_yy),
-            hamming_loss(unknown_y, unknown_yy)), file=tex)
+            hamming_loss(train_y, train_yy, sample_weight=train_w),
+            hamming_loss(dev_y, dev_yy, sample_weight=dev_w),
+            hamming_loss(known_y, known_yy, sample_weight=known_w),
+            hamming_loss(unknown_y, unknown_yy, sample_weight=unknown_w)), file=tex)
     print("\t\tzero-one loss & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            zero_one_loss(train_y, train_yy),
-            zero_one_loss(dev_y, dev_yy),
-            zero_one_loss(known_y, known_yy),
-            zero_one_loss(unknown_y, unknown_yy)), file=tex)
+            zero_one_loss(train_y, train_yy, sample_weight=train_w),
+            zero_one_loss(dev_y, dev_yy, sample_weight=dev_w),
+            zero_one_loss(known_y, known_yy, sample_weight=known_w),
+            zero_one_loss(unknown_y, unknown_yy, sample_weight=unknown_w)), file=tex)
     print("\t\t$R_k$ & %.3f & %.3f & %.3f & %.3f\\\\" % (
-            matthews_corrcoef(train_y, train_yy),
-            matthews_corrcoef(dev_y, dev_yy),
-            matthews_corrcoef(known_y, known_yy),
-            matthews_corrcoef(unknown_y, unknown_yy)), file=tex)
+            matthews_corrcoef(train_y, train_yy, sample_weight=train_w),
+            matthews_corrcoef(dev_y, dev_yy, sample_weight=dev_w),
+            matthews_corrcoef(known_y, known_yy, sample_weight=known_w),
+            matthews_corrcoef(unknown_y, unknown_yy, sample_weight=unknown_w)), file=tex)
     print("\t\t\\bottomrule", file=tex)
     print("\t\\end{tabular}", file=tex)
     print("\t\\caption{Classification statistics for the %s.}" % description, file=tex)
@@ -203,7 +219,7 @@ def print_statistics(tex: TextIO, tag: str, description: str, train_y: Series, t
 
 
 def print_confusion(tex: TextIO, tag: str, description: str, known_y: Series, known_yy: Series,
-                    classes: Dict[int, str]) -> None:
+                    classes: Dict[int, str], known_w: Optional[Series] = None) -> None:
     """
     Prints a confusion matrix.
 
@@ -213,9 +229,12 @@ def print_confusion(tex: TextIO, tag: str, description: str, known_y: Series, kn
     :param known_y: the known set target classes
     :param known_yy: the known set inferred classes
     :param classes: the dict for decoding the outputs
+    :param known_w: the known set sample weights or None
     """
 
-    confusion = confusion_matrix(known_y, known_yy)
+    confusion = confusion_matrix(known_y, known_yy, sample_weight=known_w)
+    if known_w is not None:
+        confusion = confusion.astype(int)
 
     m = {
             "dos":                  "dos",
@@ -297,7 +316,7 @@ def print_confusion(tex: TextIO, tag: str, description: str, known_y: Series, kn
 
 
 def print_packets(tex: TextIO, tag: str, description: str, known_y: Series, known_yy: Series,
-                  known_set: DataFrame) -> None:
+                  known_set: DataFrame, known_w: Optional[Series] = None) -> None:
     """
     Prints a confusion matrix.
 
@@ -307,20 +326,22 @@ def print_packets(tex: TextIO, tag: str, description: str, known_y: Series, know
     :param known_y: the known set target classes
     :param known_yy: the known set inferred classes
     :param known_set: the known test set
+    :param known_w: the known set sample weights or None
     """
 
     packets = known_set["c_pkts_all"] + known_set["s_pkts_all"]
     data = DataFrame()
-    data["packets"] = packets
-    data["target"] = known_y
-    data["inferred"] = known_yy
+    data["packets"] = packets.to_numpy()
+    data["target"] = known_y.to_numpy()
+    data["inferred"] = known_yy.to_numpy()
+    data["weight"] = 1 if known_w is None else known_w.to_numpy()
     data.sort_values(by="packets", inplace=True)
     values = []
     for j in unique(data["packets"]):
         if j > 50:
             break
         d = data[data["packets"] == j]
-        m = balanced_accuracy_score(d["target"], d["inferred"]) * 100
+        m = balanced_accuracy_score(d["target"], d["inferred"], sample_weight=d["weight"]) * 100
         values.append({"packets": j, "metric": m})
     table = DataFrame(data=values)
 
@@ -341,7 +362,8 @@ def print_packets(tex: TextIO, tag: str, description: str, known_y: Series, know
     print("\\end{figure}", file=tex)
 
 
-def print_unknown(tex: TextIO, tag: str, description: str, unknown_yy: Series, unknown_set: DataFrame) -> None:
+def print_unknown(tex: TextIO, tag: str, description: str, unknown_yy: Series, unknown_set: DataFrame,
+                  unknown_w: Optional[Series] = None) -> None:
     """
     Prints the classification for the unknown tools.
 
@@ -350,12 +372,14 @@ def print_unknown(tex: TextIO, tag: str, description: str, unknown_yy: Series, u
     :param description: a description for the caption
     :param unknown_yy: the unknown set inferred classes
     :param unknown_set: the unknown test set
+    :param unknown_w: the unknown set sample weights or None
     """
 
     table = DataFrame()
-    table["y"] = unknown_set["application_long"]
-    table["yy"] = unknown_yy
-    table = DataFrame(table.groupby(["y", "yy"]).size())
+    table["y"] = unknown_set["application_long"].to_numpy()
+    table["yy"] = unknown_yy.to_numpy()
+    table["w"] = 1 if unknown_w is None else unknown_w.to_numpy()
+    table = DataFrame(table.groupby(["y", "yy"])["w"].sum())
 
     print("\\begin{table}[H]", file=tex)
     print("\t\\centering", file=tex)
@@ -8,47 +8,63 @@ from hyperopt.hp import choice
 from hyperopt.hp import uniform
 from hyperopt.hp import uniformint
 from numpy import float32
-from pandas import read_csv
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
-from sklearn.utils import compute_class_weight
 from skorch import NeuralNetClassifier
 from torch import Tensor
 from torch.optim import Adam
 
 from data import features
+from data import read_data_set
+from data import weights_of
 from ml import NeuralModule
+from ml import balanced_class_weights
 from ml import optimize
 
 # Parses the input arguments.
 parser = ArgumentParser(description="Optimizes a set of classifiers.")
 parser.add_argument("output", help="the name of the output feature")
-parser.add_argument("--training_set", default="datasets/training.csv.gz", help="the name of the training set")
-parser.add_argument("--dev_set", default="datasets/dev.csv.gz", help="the name of the dev set")
+parser.add_argument("--training_set", default="datasets/training.csv.gz",
+                    help="the name of the training set (a CSV file or a columnar folder)")
+parser.add_argument("--dev_set", default="datasets/dev.csv.gz",
+                    help="the name of the dev set (a CSV file or a columnar folder)")
 parser.add_argument("--folder", default="models", help="the folder for saving the models")
 parser.add_argument("--timeout", type=int, default=60 * 60 * 24, help="the optimization timeout in seconds")
 parser.add_argument("--window", type=int, default=30, help="the stability window size")
 parser.add_argument("--jobs", type=int, default=-1, help="the number of cores to use")
+parser.add_argument("--parallel", type=int, default=None,
+                    help="the number of forest trials evaluated at once, sharing the cores (default: one every 4)")
+parser.add_argument("--fidelities", type=int, default=1,
+                    help="the number of fidelities of the successive halving (default: only the full one)")
+parser.add_argument("--eta", type=int, default=3, help="the ratio between two consecutive fidelities")
+parser.add_argument("--cache", default=None,
+                    help="the folder caching the MCC of the evaluated trials (default: evaluations in the folder)")
 args = parser.parse_args()
+cache = "%s/evaluations" % args.folder if args.cache is None else args.cache
 
 # Reads the data sets.
-training_set = read_csv(args.training_set)
-dev_set = read_csv(args.dev_set)
+training_set = read_data_set(args.training_set, [*features, args.output], ["weight"])
+dev_set = read_data_set(args.dev_set, [*features, args.output], ["weight"])
 train_x = training_set.loc[:, features].astype(float32)
 train_y = training_set.loc[:, args.output].astype("category")
-class_weights = compute_class_weight("balanced", classes=train_y.cat.categories, y=train_y)
+train_w = weights_of(training_set)
+class_weights = balanced_class_weights(train_y, train_w)
 dev_x = dev_set.loc[:, features].astype(float32)
 dev_y = dev_set.loc[:, args.output].astype("category")
+dev_w = weights_of(dev_set)
 
 # Creates the scaler.
 scaler = StandardScaler()
-scaler.fit(train_x)
+scaler.fit(train_x, sample_weight=train_w)
+
+# The weighted data sets need explicit class weights, since "balanced" ignores the sample weights.
+class_weight = "balanced" if train_w is None else dict(zip(train_y.cat.categories, class_weights))
 
 # Optimizes the classifiers.
 optimize("extra-trees", "%s/%s-extra_trees.joblib" % (args.folder, args.output),
          ExtraTreesClassifier, {
-                 "class_weight": "balanced",
+                 "class_weight": class_weight,
                  "n_jobs":       args.jobs
          }, {
                  "n_estimators":      uniformint("n_estimators", 1, 500),
@@ -56,11 +72,12 @@ optimize("extra-trees", "%s/%s-extra_trees.joblib" % (args.folder, args.output),
                  "max_depth":         uniformint("max_depth", 5, 20),
                  "min_samples_split": uniformint("min_samples_split", 2, 50),
                  "min_samples_leaf":  uniformint("min_samples_leaf", 2, 50)
-         }, train_x, train_y, dev_x, dev_y, False, scaler, args.timeout, args.window)
+         }, train_x, train_y, dev_x, dev_y, False, scaler, args.timeout, args.window, train_w, dev_w, args.parallel,
+         "n_estimators", args.fidelities, args.eta, cache)
 
 optimize("random forest", "%s/%s-random_forest.joblib" % (args.folder, args.output),
          RandomForestClassifier, {
-                 "class_weight": "balanced",
+                 "class_weight": class_weight,
                  "n_jobs":       args.jobs
          }, {
                  "n_estimators":      uniformint("n_estimators", 1, 500),
@@ -68,7 +85,8 @@ optimize("random forest", "%s/%s-random_forest.joblib" % (args.folder, args.outp
                  "max_depth":         uniformint("max_depth", 5, 20),
                  "min_samples_split": uniformint("min_samples_split", 2, 50),
                  "min_samples_leaf":  uniformint("min_samples_leaf", 2, 50)
-         }, train_x, train_y, dev_x, dev_y, False, scaler, args.timeout, args.window)
+         }, train_x, train_y, dev_x, dev_y, False, scaler, args.timeout, args.window, train_w, dev_w, args.parallel,
+         "n_estimators", args.fidelities, args.eta, cache)
 
 optimize("neural network", "%s/%s-nn.joblib" % (args.folder, args.output),
          NeuralNetClassifier, {
@@ -88,4 +106,5 @@ optimize("neural network", "%s/%s-nn.joblib" % (args.folder, args.output),
                  "module__layers":            uniformint("module__layers", 1, 10),
                  "module__neurons_per_layer": uniformint("module__neurons_per_layer", 16, 512),
                  "module__p":                 uniform("module__p", 0.1, 0.5),
-         }, train_x, train_y, dev_x, dev_y, True, scaler, args.timeout, args.window)
+         }, train_x, train_y, dev_x, dev_y, True, scaler, args.timeout, args.window, train_w, dev_w, 1,
+         "max_epochs", args.fidelities, args.eta, cache)
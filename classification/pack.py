@@ -0,0 +1,25 @@
+"""
+Model packer.
+"""
+
+from argparse import ArgumentParser
+
+from joblib import dump
+
+from ml import load_model
+from ml import save_model
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Converts some models, in place, to the memory-mappable format or back to joblib")
+parser.add_argument("--unpack", action="store_true", help="convert the models back to compressed joblib files")
+parser.add_argument("model", nargs="+", help="the name of a model")
+args = parser.parse_args()
+
+# Converts the models.
+for path in args.model:
+    print("converting %s..." % path)
+    model = load_model(path, False)
+    if args.unpack:
+        dump(model, path, compress=9)
+    else:
+        save_model(model, path)
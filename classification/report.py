@@ -6,14 +6,15 @@ from argparse import ArgumentParser
 from glob import glob
 from warnings import simplefilter
 
-from joblib import load
 from numpy import float32
-from pandas import read_csv
 from pandas import set_option
 from skorch.exceptions import DeviceWarning
 
 from data import features
+from data import read_data_set
+from data import weights_of
 from ml import classify
+from ml import load_model
 from ml import print_confusion
 from ml import print_data_set
 from ml import print_hyperparameters
@@ -38,15 +39,19 @@ simplefilter(action="ignore", category=DeviceWarning)
 simplefilter(action="ignore", category=UserWarning)
 
 # Reads the data sets.
-data_set = read_csv(args.data_set)
-training_set = read_csv(args.training_set)
-known_set = read_csv(args.known_set)
-unknown_set = read_csv(args.unknown_set)
-dev_set = read_csv(args.dev_set)
+data_set = read_data_set(args.data_set)
+training_set = read_data_set(args.training_set)
+known_set = read_data_set(args.known_set)
+unknown_set = read_data_set(args.unknown_set)
+dev_set = read_data_set(args.dev_set)
 train_x = training_set.loc[:, features].astype(float32)
 dev_x = dev_set.loc[:, features].astype(float32)
 known_x = known_set.loc[:, features].astype(float32)
 unknown_x = unknown_set.loc[:, features].astype(float32)
+train_w = weights_of(training_set)
+dev_w = weights_of(dev_set)
+known_w = weights_of(known_set)
+unknown_w = weights_of(unknown_set)
 
 # Generates the data set report.
 groups = {"category": "category", "application_short": "tool", "application_long": "tool instance"}
@@ -54,7 +59,7 @@ for k, v in groups.items():
     tex = "%s/data_set_%s.tex" % (args.output, k)
     print("generating %s..." % tex)
     with open(tex, "w") as f:
-        print_data_set(f, k, v, data_set, k)
+        print_data_set(f, k, v, data_set, k, weights_of(data_set))
 
 # Generates the classifier reports.
 m = {
@@ -91,10 +96,12 @@ m = {
 }
 
 outputs = {"category": "category", "application_short": "tool", "application_long": "tool instance"}
+# All the models trained together share the same scaler, so every data set is scaled only once.
+cache = {}
 first = True
 for output, what in outputs.items():
     for i in sorted(glob("%s/%s-*.joblib" % (args.folder, output))):
-        model = load(i)
+        model = load_model(i)
         name = model["name"]
         description = "%s classifier based on %s" % (what, name)
         tag = ("%s_%s" % (output, name)).replace("-", "_").replace(" ", "_")
@@ -107,15 +114,15 @@ for output, what in outputs.items():
 
             classes = dict(enumerate(training_set.loc[:, output].astype("category").cat.categories))
             train_y = training_set.loc[:, output].astype("category")
-            train_yy, train_p = classify(model, train_x, classes)
+            train_yy, train_p = classify(model, train_x, classes, cache=cache)
             dev_y = dev_set.loc[:, output].astype("category")
-            dev_yy, dev_p = classify(model, dev_x, classes)
+            dev_yy, dev_p = classify(model, dev_x, classes, cache=cache)
             known_y = known_set.loc[:, output].astype("category")
-            known_yy, known_p = classify(model, known_x, classes)
+            known_yy, known_p = classify(model, known_x, classes, cache=cache)
             unknown_y = unknown_set.loc[:, output].astype("category")
-            unknown_yy, unknown_p = classify(model, unknown_x, classes)
+            unknown_yy, unknown_p = classify(model, unknown_x, classes, cache=cache)
             print_statistics(f, tag, description, train_y, train_yy, dev_y, dev_yy, known_y, known_yy, unknown_y,
-                             unknown_yy)
-            print_confusion(f, tag, description, known_y, known_yy, classes)
-            print_packets(f, tag, description, known_y, known_yy, known_set)
-            print_unknown(f, tag, description, unknown_yy, unknown_set)
+                             unknown_yy, train_w, dev_w, known_w, unknown_w)
+            print_confusion(f, tag, description, known_y, known_yy, classes, known_w)
+            print_packets(f, tag, description, known_y, known_yy, known_set, known_w)
+            print_unknown(f, tag, description, unknown_yy, unknown_set, unknown_w)
@@ -0,0 +1,63 @@
+"""
+Inference server.
+"""
+
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from os.path import basename
+from os.path import splitext
+from warnings import simplefilter
+
+from data import features
+from ml import Batcher
+from ml import InferenceServer
+from ml import load_model
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Serves some models, classifying the concurrent requests in batches")
+parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+parser.add_argument("--port", type=int, default=8000, help="the port to listen on")
+parser.add_argument("--socket", default=None, help="the Unix socket to listen on instead of a TCP port")
+parser.add_argument("--max_batch", type=int, default=1024, help="the maximum number of flows to classify at once")
+parser.add_argument("--max_wait", type=float, default=0.005,
+                    help="the maximum seconds a request waits for other requests to fill a batch")
+parser.add_argument("--max_queue", type=int, default=65536,
+                    help="the maximum number of flows waiting or being classified for every model")
+parser.add_argument("--queue_timeout", type=float, default=0.1,
+                    help="the maximum seconds a request waits for some room in the queue before being rejected")
+parser.add_argument("--step", type=int, default=None,
+                    help="the trees evaluated at a time by the early exit of a forest (default: no early exit)")
+parser.add_argument("--tolerance", type=float, default=0,
+                    help="the maximum probability that the early exit changes the class of a flow")
+parser.add_argument("--classes", default=None,
+                    help="the comma separated list of the class names, for the models that do not store them")
+parser.add_argument("model", nargs="+", help="the name of a model, served as /classify/<model name>")
+args = parser.parse_args()
+
+simplefilter(action="ignore", category=UserWarning)
+
+# Loads the models.
+batchers = {}
+for path in args.model:
+    model = load_model(path, estimators=False)
+    if args.classes is not None:
+        classes = args.classes.split(",")
+    elif "classes" in model:
+        classes = model["classes"]
+    elif not model["numbers"]:
+        classes = model["classifier"].classes_
+    else:
+        parser.error("the model %s does not store its class names, use --classes" % path)
+    if args.step is not None and "flat" not in model and not hasattr(model["classifier"], "estimators_"):
+        parser.error("the model %s is not a forest, it has no early exit" % path)
+    batchers[splitext(basename(path))[0]] = Batcher(model, classes, args.max_batch, args.max_wait, args.max_queue,
+                                                    args.queue_timeout, step=args.step, tolerance=args.tolerance)
+
+# Serves the models.
+server = InferenceServer(batchers, features)
+if args.socket is not None:
+    print("Serving on %s" % args.socket)
+    get_event_loop().run_until_complete(server.serve_unix(args.socket))
+else:
+    print("Serving on %s:%d" % (args.host, args.port))
+    get_event_loop().run_until_complete(server.serve(args.host, args.port))
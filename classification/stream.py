@@ -0,0 +1,54 @@
+"""
+Live classifier.
+"""
+
+from argparse import ArgumentParser
+from sys import stdout
+from warnings import simplefilter
+
+from data import features
+from ml import TstatFollower
+from ml import classify_stream
+from ml import load_model
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Classifies the flows logged by tstat during a live capture")
+parser.add_argument("--output", default=None, help="the JSON lines file for the verdicts (default: standard output)")
+parser.add_argument("--latency", type=float, default=1,
+                    help="the target seconds between reading and classifying a flow")
+parser.add_argument("--batch_size", type=int, default=4096, help="the maximum number of flows to classify at once")
+parser.add_argument("--poll", type=float, default=0.1, help="the seconds between two reads of the logs")
+parser.add_argument("--classes", default=None,
+                    help="the comma separated list of the class names, for the models that do not store them")
+parser.add_argument("--from_end", action="store_true", help="skip the flows already logged")
+parser.add_argument("--probabilities", action="store_true", help="also write the probabilities of all the classes")
+parser.add_argument("--step", type=int, default=None,
+                    help="the trees evaluated at a time by the early exit of a forest (default: no early exit)")
+parser.add_argument("--tolerance", type=float, default=0,
+                    help="the maximum probability that the early exit changes the class of a flow")
+parser.add_argument("model", help="the name of the model")
+parser.add_argument("logs", help="the tstat output folder or the folder containing the logs")
+args = parser.parse_args()
+
+simplefilter(action="ignore", category=UserWarning)
+
+# Loads the model.
+model = load_model(args.model, estimators=False)
+if args.classes is not None:
+    classes = dict(enumerate(args.classes.split(",")))
+elif "classes" in model:
+    classes = dict(enumerate(model["classes"]))
+elif not model["numbers"]:
+    classes = dict(enumerate(model["classifier"].classes_))
+else:
+    parser.error("the model does not store its class names, use --classes")
+if args.step is not None and "flat" not in model and not hasattr(model["classifier"], "estimators_"):
+    parser.error("the model is not a forest, it has no early exit")
+
+# Classifies the flows.
+output = stdout if args.output is None else open(args.output, "a")
+try:
+    classify_stream(model, TstatFollower(args.logs, args.from_end), features, classes, output, args.latency,
+                    args.batch_size, args.poll, args.probabilities, args.step, args.tolerance)
+finally:
+    output.close()
@@ -1,24 +1,108 @@
 from argparse import ArgumentParser
+from errno import ENXIO
 from glob import glob
+from gzip import open as gzip_open
+from hashlib import sha256
+from json import dump
+from json import load
+from multiprocessing import cpu_count
+from multiprocessing import get_context
+from os import O_NONBLOCK
+from os import O_WRONLY
 from os import listdir
+from os import makedirs
+from os import mkfifo
+from os import open as os_open
+from os import replace
+from os import set_blocking
 from os import system
 from os import unlink
+from os.path import basename
+from os.path import exists
+from os.path import getsize
 from os.path import isdir
+from os.path import join
+from shlex import split as split_command
+from shutil import copyfile
+from shutil import copyfileobj
+from shutil import move
+from shutil import rmtree
+from shutil import which
+from signal import SIGTERM
+from signal import signal
+from subprocess import DEVNULL
+from subprocess import Popen
+from tempfile import mkdtemp
+from time import monotonic
+from time import sleep
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import TextIO
+from typing import Tuple
 
 from numpy import linspace
-# Parses the input arguments.
-from numpy import split
 from pandas import DataFrame
 from pandas import read_csv
+from pandas.util import hash_pandas_object
+
+from processing import ColumnarWriter
+from processing import columns
+from processing import extract
+from processing import truncate
+from processing import types
+from processing import version
 
+# Parses the input arguments.
 parser = ArgumentParser(description="Generates the final data sets")
 parser.add_argument("--tstat", default="tstat-3.1.1/tstat/tstat", help="the tstat command")
-parser.add_argument("--dev_ratio", default=10, help="the dev set ratio")
-parser.add_argument("--test_ratio", default=10, help="the test set ratio")
-parser.add_argument("pcap", help="the name of the pcap folder")
-parser.add_argument("dataset", help="the name of the data set folder")
+parser.add_argument("--extractor", default="tstat", choices=["tstat", "native"],
+                    help="the flow statistics extractor, either tstat on the truncated pcaps or the built-in one")
+parser.add_argument("--piped", action="store_true",
+                    help="stream the truncated pcaps to tstat through named pipes instead of writing them to disk")
+parser.add_argument("--pipes", type=int, default=4,
+                    help="the maximum number of tstat instances fed at the same time in piped mode, bounding the tstat "
+                         "logs on the scratch disk (0 for all)")
+parser.add_argument("--chunk_size", type=int, default=1000000, help="the number of rows to process at once")
+parser.add_argument("--jobs", type=int, default=-1, help="the number of pcap files to process in parallel")
+parser.add_argument("--scratch", default=None, help="the folder for the temporary files")
+parser.add_argument("--cache", default=None,
+                    help="the folder caching the flows of every pcap file and threshold, keyed by the pcap content, "
+                         "the extractor and the labels, so that only new or changed pcap files are processed")
+parser.add_argument("--dev_ratio", type=float, default=10, help="the dev set ratio")
+parser.add_argument("--test_ratio", type=float, default=10, help="the test set ratio")
+parser.add_argument("--columnar", action="store_true",
+                    help="also write every data set in the memory-mappable columnar format")
+parser.add_argument("--deduplicate", action="store_true",
+                    help="collapse the identical flows into a single one with a weight column (the forests trained on "
+                         "the weighted rows differ from the ones trained on the repeated flows)")
+parser.add_argument("--buckets", type=int, default=256, help="the number of on-disk buckets for the deduplication")
+parser.add_argument("--seed", type=int, default=0, help="the seed of the data set split")
+parser.add_argument("--shard", default=None,
+                    help="only process a shard of the (pcap file, threshold) pairs, as <index>/<count>, and write a "
+                         "partition to be merged with --merge instead of the data sets")
+parser.add_argument("--manifest", default=None,
+                    help="a file listing the pcap files to process, one per line, instead of all the ones in the pcap "
+                         "folder, and write a partition to be merged with --merge instead of the data sets")
+parser.add_argument("--merge", action="store_true", help="create the data sets by merging some partitions")
+parser.add_argument("pcap", nargs="+", help="the name of the pcap folder or, with --merge, of the partition folders")
+parser.add_argument("dataset", help="the name of the data set or partition folder")
 args = parser.parse_args()
 
+if not args.merge and len(args.pcap) > 1:
+    parser.error("only one pcap folder can be analyzed")
+if args.shard is None:
+    shard = (0, 1)
+else:
+    try:
+        shard = tuple(int(i) for i in args.shard.split("/"))
+    except ValueError:
+        shard = ()
+    if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+        parser.error("the shard must be <index>/<count> with 0 <= index < count")
+
 thresholds = linspace(0.000000, 0.001000, 11).tolist()
 thresholds += linspace(0.001000, 0.010000, 10).tolist()
 thresholds += linspace(0.010000, 0.100000, 10).tolist()
@@ -26,35 +110,36 @@ thresholds += linspace(0.100000, 1.000000, 10).tolist()
 thresholds += linspace(1.000000, 10.000000, 10).tolist()
 thresholds += linspace(10.000000, 100.000000, 10).tolist()
 thresholds += linspace(100.000000, 1000.000000, 10).tolist()
-thresholds = set(thresholds)
+thresholds = sorted(set(thresholds))
 
+# Identifies the flow statistics extractor in the cache keys.
+if args.extractor == "native":
+    extractor = "native %d" % version
+elif which(split_command(args.tstat)[0]) is None:
+    extractor = "tstat %s" % args.tstat
+else:
+    with open(which(split_command(args.tstat)[0]), "rb") as f:
+        extractor = "tstat %s" % sha256(f.read()).hexdigest()
 
-def split_capture(folder: str, threshold: float) -> None:
-    """
-    Splits some pcap files into multiple smaller capture files.
-
-    :param folder: the name of the folder containing the pcap files to split
-    :param threshold: the time threshold
-    """
-
-    system("mkdir -p %s-%f" % (folder, threshold))
+# The version of the cached parts, to be increased whenever the truncation or the reading of the logs change.
+parts_version = 1
 
-    for f in listdir(folder):
-        if f.endswith(".pcap"):
-            system("tshark -r %s/%s -w %s-%f/%s -Y \"tcp.time_relative <= %f\"" %
-                   (folder, f, folder, threshold, f, threshold))
+header = " ".join([*columns, "complete", "application_short", "application_long", "os_short", "os_long", "all",
+                   "category"])
 
 
-def create_data_set(source: str, output: str) -> None:
+def labels(name: str) -> str:
     """
-    Creates a CSV file by launching tstat.
+    Computes the label columns of the flows in a pcap file.
 
-    :param source: the source file
-    :param output: the output folder
+    :param name: the name of the pcap file, in the <application>_<os>_<hypervisor>.pcap format
+    :return: the space-separated values of the application_short, application_long, os_short, os_long, all and category
+             columns
     """
 
-    prefix = "dataset"
-    parts = source.split("-")
+    parts = name[:-5].split("_")
+    app_parts = parts[0].split("-")
+    os_parts = parts[1].split("-")
 
     m = {
             "dos":                  "dos",
@@ -89,86 +174,472 @@ def create_data_set(source: str, output: str) -> None:
             "wget-1.19.5":          "crawler"
     }
 
-    if len(parts) == 1:
-        name = "%s/%s-all.csv" % (output, prefix)
+    return "%s %s %s %s %s_%s %s" % (app_parts[0], parts[0], os_parts[0], parts[1], parts[0], parts[1], m[parts[0]])
+
+
+def run_tstat(capture: str, folder: str, label: str, o: TextIO) -> None:
+    """
+    Launches tstat on a pcap file and writes the labeled flows to a CSV file.
+
+    :param capture: the name of the pcap file
+    :param folder: the tstat output folder
+    :param label: the label columns of the flows
+    :param o: the output CSV file
+    """
+
+    code = Popen([*split_command(args.tstat), capture, "-s", folder], stdout=DEVNULL).wait()
+    if code != 0:
+        raise RuntimeError("tstat failed on %s with exit code %d" % (capture, code))
+    read_tstat(folder, label, o)
+
+
+def read_tstat(folder: str, label: str, o: TextIO) -> None:
+    """
+    Writes the labeled flows found in a tstat output folder to a CSV file and removes the folder.
+
+    :param folder: the tstat output folder
+    :param label: the label columns of the flows
+    :param o: the output CSV file
+    """
+
+    if not isdir(folder) or not listdir(folder):
+        raise RuntimeError("tstat wrote no logs in %s" % folder)
+
+    values = dict(zip(["application_short", "application_long", "os_short", "os_long", "all", "category"],
+                      label.split(" ")))
+    for t in ["log_tcp_complete", "log_tcp_nocomplete"]:
+        log = "%s/%s/%s" % (folder, listdir(folder)[0], t)
+        chunks = read_csv(log, sep=" ", header=None, skiprows=1, usecols=range(len(columns)), names=columns,
+                          dtype=types, chunksize=args.chunk_size)
+        for chunk in chunks:
+            chunk = chunk.assign(complete="true" if t == "log_tcp_complete" else "false", **values)
+            chunk.to_csv(o, sep=" ", header=False, index=False)
+
+    system("rm -fr %s" % folder)
+
+
+def initialize_worker() -> None:
+    """
+    Makes a worker process exit normally when the pool is terminated after a failure, so that it stops its tstat
+    instances.
+    """
+
+    signal(SIGTERM, lambda signum, frame: exit(1))
+
+
+def open_pipe(pipe: str, process: Popen, timeout: float = 60) -> BinaryIO:
+    """
+    Opens a named pipe for writing as soon as the tstat process reading it has opened it.
+
+    :param pipe: the name of the pipe
+    :param process: the tstat process
+    :param timeout: the maximum time to wait in seconds
+    :return: the pipe, open in blocking mode
+    """
+
+    deadline = monotonic() + timeout
+    while True:
+        try:
+            fd = os_open(pipe, O_WRONLY | O_NONBLOCK)
+            break
+        except OSError as e:
+            # The pipe cannot be opened without blocking until it has a reader.
+            if e.errno != ENXIO:
+                raise
+        if process.poll() is not None:
+            raise RuntimeError("tstat exited with code %d before reading %s" % (process.returncode, pipe))
+        if monotonic() > deadline:
+            raise RuntimeError("tstat did not read %s within %d seconds" % (pipe, timeout))
+        sleep(0.01)
+    set_blocking(fd, True)
+
+    return open(fd, "wb")
+
+
+def fingerprint(capture: str, label: str) -> str:
+    """
+    Computes the cache key of a pcap file, i.e. a hash of its content, of the version of the parts, of the flow
+    statistics extractor and of its labels.
+
+    :param capture: the name of the pcap file
+    :param label: the label columns of the flows
+    :return: the cache key
+    """
+
+    digest = sha256()
+    with open(capture, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            digest.update(block)
+    digest.update(("\n%d\n%s\n%s" % (parts_version, extractor, label)).encode())
+
+    return digest.hexdigest()
+
+
+def analyze_capture(capture: str, label: str, selected: Sequence[float], whole: bool, folder: str) -> None:
+    """
+    Computes the labeled flows of some truncated versions of a pcap file and, optionally, of the whole pcap file.
+
+    :param capture: the name of the pcap file
+    :param label: the label columns of the flows
+    :param selected: the time thresholds of the truncated versions
+    :param whole: True to also compute the flows of the whole pcap file
+    :param folder: the scratch folder, that will contain a headerless <threshold>.csv file for every selected threshold
+                   and an all.csv file for the whole pcap file
+    """
+
+    names = ["%s/%f.csv" % (folder, i) for i in selected] + ["%s/all.csv" % folder]
+
+    if args.extractor == "native":
+        files = [open(i, "w") for i in names[:len(selected) + whole]]
+        try:
+            for index, fields, complete in extract(capture, selected):
+                if index is not None or whole:
+                    print("%s %s %s" % (" ".join(fields), "true" if complete else "false", label),
+                          file=files[-1 if index is None else index])
+        finally:
+            for o in files:
+                o.close()
+    elif args.piped:
+        # The truncated captures are streamed to tstat through named pipes, a group of thresholds at a time, and the
+        # logs of a group are moved into the CSV files and removed before the next one starts.
+        size = args.pipes if args.pipes > 0 else max(len(selected), 1)
+        for start in range(0, len(selected), size):
+            group = range(start, min(start + size, len(selected)))
+            pipes = ["%s/%f.pcap" % (folder, selected[i]) for i in group]
+            folders = ["%s/tstat-%f" % (folder, selected[i]) for i in group]
+            for p in pipes:
+                mkfifo(p)
+            command = split_command(args.tstat)
+            processes = []
+            files = []
+            try:
+                for p, f in zip(pipes, folders):
+                    processes.append(Popen([*command, p, "-s", f], stdout=DEVNULL))
+                for p, process in zip(pipes, processes):
+                    files.append(open_pipe(p, process))
+                truncate(capture, [selected[i] for i in group], files)
+            except BaseException as e:
+                # The instances still waiting for their pipes would never exit.
+                for process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                    process.wait()
+                if isinstance(e, BrokenPipeError):
+                    raise RuntimeError("tstat stopped reading the truncated versions of %s" % capture) from e
+                raise
+            finally:
+                for f in files:
+                    f.close()
+                for p in pipes:
+                    unlink(p)
+            for i, f, process in zip(group, folders, processes):
+                if process.wait() != 0:
+                    raise RuntimeError("tstat failed on %s at %f with exit code %d" % (capture, selected[i],
+                                                                                       process.returncode))
+                with open(names[i], "w") as o:
+                    read_tstat(f, label, o)
+        if whole:
+            with open(names[-1], "w") as o:
+                run_tstat(capture, "%s/tstat" % folder, label, o)
     else:
-        name = "%s/%s-%s.csv" % (output, prefix, parts[1])
-
-    with open(name, "w") as o:
-        print(
-                "c_ip c_port c_pkts_all c_rst_cnt c_ack_cnt c_ack_cnt_p c_bytes_uniq c_pkts_data c_bytes_all "
-                "c_pkts_retx c_bytes_retx c_pkts_ooo c_syn_cnt c_fin_cnt s_ip s_port s_pkts_all s_rst_cnt s_ack_cnt "
-                "s_ack_cnt_p s_bytes_uniq s_pkts_data s_bytes_all s_pkts_retx s_bytes_retx s_pkts_ooo s_syn_cnt "
-                "s_fin_cnt first last durat c_first s_first c_last s_last c_first_ack s_first_ack c_isint s_isint "
-                "c_iscrypto s_iscrypto con_t p2p_t http_t complete application_short application_long os_short "
-                "os_long all category",
-                file=o)
-        for f in listdir(source):
-            if f.endswith(".pcap"):
-                parts = f[:-5].split("_")
-                app_parts = parts[0].split("-")
-                os_parts = parts[1].split("-")
-                category = m[parts[0]]
-
-                system("%s %s/%s -s %s > /dev/null" % (args.tstat, source, f, f))
-
-                if not isdir(f):
-                    continue
-
-                tcp = []
-                tcp.append("%s/%s/log_tcp_complete" % (f, listdir("%s" % f)[0]))
-                tcp.append("%s/%s/log_tcp_nocomplete" % (f, listdir("%s" % f)[0]))
-                for t in tcp:
-                    with open(t) as csv:
-                        count = 1
-                        for row in csv.readlines():
-                            if count > 1:
-                                row = row.rstrip("\n")
-                                fields = row.split()
-                                l = " ".join(fields[0: 44])
-                                print(l, end="", file=o)
-                                if t.endswith("_complete"):
-                                    print(" true", end="", file=o)
-                                else:
-                                    print(" false", end="", file=o)
-                                print(" %s" % app_parts[0], end="", file=o)
-                                print(" %s" % parts[0], end="", file=o)
-                                print(" %s" % os_parts[0], end="", file=o)
-                                print(" %s" % parts[1], end="", file=o)
-                                print(" %s_%s" % (parts[0], parts[1]), end="", file=o)
-                                print(" %s" % category, end="", file=o)
-                                print(file=o)
-                            count += 1
-
-                system("rm -fr %s" % f)
-
-
-print("Analyzing the pcap files...")
-system("rm -fr %s/*.csv" % args.dataset)
-create_data_set(args.pcap, args.dataset)
-
-for i in thresholds:
-    split_capture(args.pcap, i)
-    create_data_set("%s-%f" % (args.pcap, i), args.dataset)
-    system("rm -fr %s-%f" % (args.pcap, i))
+        truncated = ["%s/%f.pcap" % (folder, i) for i in selected]
+        truncate(capture, selected, truncated)
+        for c, name in zip(truncated + [capture] * whole, names):
+            with open(name, "w") as o:
+                run_tstat(c, "%s/tstat" % folder, label, o)
+            if c != capture:
+                unlink(c)
+
+
+def list_captures(source: str) -> List[str]:
+    """
+    Lists the pcap files to process, either the ones in the manifest or all the ones in the source folder.
+
+    :param source: the source folder
+    :return: the names of the pcap files, sorted by their base names
+    """
+
+    if args.manifest is None:
+        names = [i for i in listdir(source) if i.endswith(".pcap")]
+    else:
+        with open(args.manifest) as f:
+            names = [i.strip() for i in f if i.strip() and not i.startswith("#")]
+
+    return sorted((join(source, i) for i in names), key=basename)
+
+
+def process_capture(work: Tuple[str, Sequence[float], bool]) -> Tuple[str, bool]:
+    """
+    Computes the labeled flows of a pcap file and of some of its truncated versions in an isolated scratch folder. When
+    the cache is enabled, only the flows missing from the cache are computed, and they are added to it.
+
+    :param work: a tuple with the name of the pcap file, the time thresholds of the truncated versions and True to also
+                 compute the flows of the whole capture
+    :return: a tuple where the first element is the folder containing a headerless CSV file for every selected threshold
+             and one for the whole capture, and the second one is True if the folder is a temporary one
+    """
+
+    capture, selected, whole = work
+    label = labels(basename(capture))
+
+    if args.cache is None:
+        scratch = mkdtemp(prefix="build_dataset-", dir=args.scratch)
+        try:
+            analyze_capture(capture, label, selected, whole, scratch)
+        except BaseException:
+            rmtree(scratch)
+            raise
+        return scratch, True
+
+    folder = "%s/%s" % (args.cache, fingerprint(capture, label))
+    selected = [i for i in selected if not exists("%s/%f.csv" % (folder, i))]
+    whole = whole and not exists("%s/all.csv" % folder)
+    if selected or whole:
+        # The scratch folder is in the cache, so that the parts can be atomically moved in place once complete.
+        makedirs(folder, exist_ok=True)
+        scratch = mkdtemp(prefix="build_dataset-", dir=args.cache)
+        try:
+            # The parts are only cached once the extractor has succeeded on all of them.
+            analyze_capture(capture, label, selected, whole, scratch)
+            for i in listdir(scratch):
+                if i.endswith(".csv"):
+                    replace("%s/%s" % (scratch, i), "%s/%s" % (folder, i))
+        finally:
+            rmtree(scratch)
+
+    return folder, False
+
+
+def create_data_set(source: str, output: str) -> None:
+    """
+    Creates the CSV files of the whole pcap files and of all their truncated versions. The pcap files are processed in
+    parallel and their flows are merged in the order of their names.
+
+    :param source: the source folder
+    :param output: the output folder
+    """
+
+    prefix = "dataset"
+    work = [(i, thresholds, True) for i in list_captures(source)]
+    parts = ["%f.csv" % i for i in thresholds] + ["all.csv"]
+    names = ["%s/%s-%f.csv" % (output, prefix, i) for i in thresholds] + ["%s/%s-all.csv" % (output, prefix)]
+
+    files = [open(i, "w") for i in names]
+    try:
+        for o in files:
+            print(header, file=o)
+        with get_context("fork").Pool(args.jobs if args.jobs > 0 else cpu_count(), initialize_worker) as pool:
+            for folder, temporary in pool.imap(process_capture, work):
+                for part, o in zip(parts, files):
+                    with open("%s/%s" % (folder, part)) as i:
+                        copyfileobj(i, o)
+                if temporary:
+                    rmtree(folder)
+    finally:
+        for o in files:
+            o.close()
+
+
+def create_partition(source: str, output: str) -> None:
+    """
+    Creates a partition of the data set, i.e. the CSV files of a shard of the (pcap file, threshold) pairs. The pairs of
+    all the pcap files, sorted by name, are split into contiguous shards of the same size, so that every pcap file is
+    read by as few nodes as possible. The partition folder contains a headerless CSV file for every pair, named
+    <pcap file>/<threshold>.csv (or all.csv for the whole capture), and a manifest.json file listing them, written last
+    so that an interrupted partition is never merged.
+
+    :param source: the source folder
+    :param output: the partition folder
+    """
+
+    index, count = shard
+    captures = list_captures(source)
+    units = [(c, i) for c in captures for i in [*thresholds, None]]
+    units = units[len(units) * index // count:len(units) * (index + 1) // count]
+    selection = {}
+    for capture, threshold in units:
+        selection.setdefault(capture, []).append(threshold)
+    work = [(c, [i for i in v if i is not None], None in v) for c, v in selection.items()]
+
+    makedirs(output, exist_ok=True)
+    if exists("%s/manifest.json" % output):
+        unlink("%s/manifest.json" % output)
+
+    done = {}
+    with get_context("fork").Pool(args.jobs if args.jobs > 0 else cpu_count(), initialize_worker) as pool:
+        for (capture, selected, whole), (folder, temporary) in zip(work, pool.imap(process_capture, work)):
+            name = basename(capture)
+            parts = ["%f.csv" % i for i in selected] + ["all.csv"] * whole
+            makedirs("%s/%s" % (output, name), exist_ok=True)
+            for part in parts:
+                if temporary:
+                    move("%s/%s" % (folder, part), "%s/%s/%s" % (output, name, part))
+                else:
+                    copyfile("%s/%s" % (folder, part), "%s/%s/%s" % (output, name, part))
+            if temporary:
+                rmtree(folder)
+            done[name] = parts
+
+    with open("%s/manifest.tmp" % output, "w") as f:
+        dump({"extractor": extractor, "thresholds": ["%f" % i for i in thresholds], "shard": list(shard),
+              "captures": [basename(i) for i in captures], "parts": done}, f, indent=4)
+    replace("%s/manifest.tmp" % output, "%s/manifest.json" % output)
+
+
+def merge_partitions(partitions: Sequence[str], output: str) -> None:
+    """
+    Creates the CSV files of the whole pcap files and of all their truncated versions from some partitions, exactly as
+    create_data_set() would do on a single node. Every (pcap file, threshold) pair of the pcap files listed by the
+    partitions must be in exactly one partition.
+
+    :param partitions: the partition folders
+    :param output: the output folder
+    """
+
+    prefix = "dataset"
+    parts = ["%f.csv" % i for i in thresholds] + ["all.csv"]
+    names = ["%s/%s-%f.csv" % (output, prefix, i) for i in thresholds] + ["%s/%s-all.csv" % (output, prefix)]
+
+    sources: Dict[str, Dict[str, str]] = {}
+    extractors = set()
+    for partition in partitions:
+        if not exists("%s/manifest.json" % partition):
+            parser.error("%s is not a complete partition" % partition)
+        with open("%s/manifest.json" % partition) as f:
+            manifest = load(f)
+        if manifest["thresholds"] != ["%f" % i for i in thresholds]:
+            parser.error("%s was created with different thresholds" % partition)
+        extractors.add(manifest["extractor"])
+        for capture in manifest["captures"]:
+            sources.setdefault(capture, {})
+        for capture, found in manifest["parts"].items():
+            for part in found:
+                if part in sources.setdefault(capture, {}):
+                    parser.error("%s/%s is in more than one partition" % (capture, part))
+                sources[capture][part] = partition
+    if len(extractors) > 1:
+        parser.error("the partitions were created with different extractors")
+    for capture, found in sources.items():
+        if len(found) < len(parts):
+            parser.error("the partitions lack %d parts of %s" % (len(parts) - len(found), capture))
+
+    files = [open(i, "w") for i in names]
+    try:
+        for o in files:
+            print(header, file=o)
+        for capture in sorted(sources):
+            for part, o in zip(parts, files):
+                with open("%s/%s/%s" % (sources[capture][part], capture, part)) as i:
+                    copyfileobj(i, o)
+    finally:
+        for o in files:
+            o.close()
+
+
+def read_flows(output: str, dtype: Dict[str, type]) -> Iterator[DataFrame]:
+    """
+    Streams the flows in the CSV files of all the thresholds, without their addresses and ports, and removes the files.
+
+    :param output: the output folder
+    :param dtype: the types of the columns
+    :return: an iterator of chunks of flows
+    """
+
+    for i in sorted(glob("%s/dataset-*.csv" % output)):
+        for chunk in read_csv(i, sep=" ", dtype=dtype, chunksize=args.chunk_size):
+            yield chunk.drop(columns=["c_ip", "s_ip", "c_port", "s_port"])
+        unlink(i)
+
+
+def deduplicate(chunks: Iterator[DataFrame], dtype: Dict[str, type]) -> Iterator[DataFrame]:
+    """
+    Collapses the identical flows into a single one with a weight column counting them. The flows are first spilled to
+    disk into buckets by a hash of their values, so that only a bucket at a time has to fit in memory.
+
+    :param chunks: the chunks of flows
+    :param dtype: the types of the columns
+    :return: an iterator of chunks of unique flows
+    """
+
+    scratch = mkdtemp(prefix="build_dataset-", dir=args.scratch)
+    names = ["%s/%d.csv" % (scratch, i) for i in range(args.buckets)]
+    files = [open(i, "w") for i in names]
+    try:
+        for chunk in chunks:
+            buckets = hash_pandas_object(chunk, index=False).to_numpy() % args.buckets
+            for b, part in chunk.groupby(buckets, sort=False):
+                part.to_csv(files[b], header=files[b].tell() == 0, index=False)
+    finally:
+        for f in files:
+            f.close()
+
+    for name in names:
+        if getsize(name) > 0:
+            bucket = read_csv(name, dtype=dtype)
+            yield bucket.groupby(list(bucket.columns), sort=False, dropna=False).size().rename("weight").reset_index()
+        unlink(name)
+    rmtree(scratch)
+
+
+def split_data_set(output: str) -> None:
+    """
+    Merges the CSV files of all the thresholds and splits their flows into the training, dev, known tools and unknown
+    tools sets. The files are streamed in chunks, and every known tool flow is assigned to a set by a seeded hash of its
+    values, so the memory usage does not depend on the data set size and identical flows always end up in the same set.
+
+    :param output: the output folder
+    """
+
+    unknown = ["grabsite-2.1.16", "opera-62.0.3331.66", "slowhttptest-1.6", "firefox-68.0"]
+    key = ("%016d" % args.seed)[-16:]
+    training_limit = 1 - args.dev_ratio / 100 - args.test_ratio / 100
+    dev_limit = 1 - args.dev_ratio / 100
+    dtype = {**types, "complete": bool}
+    dtype.update({i: str for i in ["application_short", "application_long", "os_short", "os_long", "all", "category"]})
+
+    chunks = read_flows(output, dtype)
+    if args.deduplicate:
+        chunks = deduplicate(chunks, dtype)
+
+    names = ["dataset", "training", "dev", "known", "unknown"]
+    files = [gzip_open("%s/%s.csv.gz" % (output, i), "wt") for i in names]
+    if args.columnar:
+        writers = [ColumnarWriter("%s/%s.columns" % (output, i), ["first", "last"]) for i in names]
+    else:
+        writers = []
+    try:
+        first = True
+        for chunk in chunks:
+            values = chunk.drop(columns="weight", errors="ignore")
+            u = hash_pandas_object(values, index=False, hash_key=key).to_numpy() / 2 ** 64
+            known = ~chunk["application_long"].isin(unknown).to_numpy()
+            training = known & (u < training_limit)
+            dev = known & (u >= training_limit) & (u < dev_limit)
+            parts = [chunk, chunk[training], chunk[dev], chunk[known & (u >= dev_limit)], chunk[~known]]
+            for part, f in zip(parts, files):
+                part.to_csv(f, header=first, index=False)
+            for part, w in zip(parts, writers):
+                w.write(part)
+            first = False
+    finally:
+        for f in files:
+            f.close()
+        for w in writers:
+            w.close()
+
+
+if args.merge:
+    print("Merging the partitions...")
+    system("rm -fr %s/*.csv" % args.dataset)
+    merge_partitions(args.pcap, args.dataset)
+elif args.shard is not None or args.manifest is not None:
+    print("Analyzing the pcap files of shard %d/%d..." % shard)
+    create_partition(args.pcap[0], args.dataset)
+    exit()
+else:
+    print("Analyzing the pcap files...")
+    system("rm -fr %s/*.csv" % args.dataset)
+    create_data_set(args.pcap[0], args.dataset)
 
 print("Processing the statistics...")
-data_set = DataFrame()
-for i in glob("%s/*.csv" % args.dataset):
-    data_set = data_set.append(read_csv(i, sep=" "))
-    unlink(i)
-del data_set["c_ip"]
-del data_set["s_ip"]
-del data_set["c_port"]
-del data_set["s_port"]
-data_set.to_csv("%s/dataset.csv.gz" % args.dataset)
-unknown = ["grabsite-2.1.16", "opera-62.0.3331.66", "slowhttptest-1.6", "firefox-68.0"]
-unknown_set = data_set[data_set["application_long"].isin(unknown)]
-data_set = data_set[~data_set["application_long"].isin(unknown)]
-training_set, dev_set, known_set = split(data_set.sample(frac=1),
-                                         [int((1 - args.dev_ratio / 100 - args.test_ratio / 100) * len(data_set)),
-                                          int((1 - args.dev_ratio / 100) * len(data_set))])
-training_set.to_csv("%s/training.csv.gz" % args.dataset)
-dev_set.to_csv("%s/dev.csv.gz" % args.dataset)
-known_set.to_csv("%s/known.csv.gz" % args.dataset)
-unknown_set.to_csv("%s/unknown.csv.gz" % args.dataset)
+split_data_set(args.dataset)
@@ -0,0 +1,12 @@
+"""
+Traffic capturing stuff.
+"""
+from .orchestrator import Unit
+from .orchestrator import load_spec
+from .orchestrator import orchestrate
+from .server import Resource
+from .server import Site
+from .server import StandInServer
+from .session import CaptureSession
+from .session import stop_group
+from .tools import tools
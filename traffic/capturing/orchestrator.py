@@ -0,0 +1,201 @@
+"""
+Capture orchestration stuff.
+"""
+from asyncio import FIRST_COMPLETED
+from asyncio import Task
+from asyncio import create_subprocess_exec
+from asyncio import ensure_future
+from asyncio import wait
+from ipaddress import ip_address
+from json import load
+from os import replace
+from shutil import rmtree
+from tempfile import mkdtemp
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from urllib.parse import urlsplit
+
+from .session import CaptureSession
+from .tools import tools
+
+
+class Unit(NamedTuple):
+    """
+    A capture unit, i.e. a run of a tool against a single target while sniffing its traffic.
+    """
+
+    pcap: str
+    url: str
+    command: List[str]
+    endpoint: Tuple[str, int]
+    filter: str
+    exclusive: bool
+    duration: Optional[float]
+
+
+def load_spec(path: str) -> List[Unit]:
+    """
+    Loads a traffic specification, i.e. a JSON file like:
+
+        {
+            "os": "linux-4.17.0",
+            "hypervisor": "none",
+            "isolate": true,
+            "sessions": [
+                {"app": "curl-7.61.0", "targets": ["http://10.0.0.1/", "https://10.0.0.2/"]},
+                {"app": "slowhttptest-1.6-H", "tool": "slowhttptest", "arguments": ["-H"], "targets": [...]}
+            ]
+        }
+
+    Every session runs a tool (by default the first dash-separated part of the application name) against each of its
+    targets and produces the <app>_<os>_<hypervisor>.pcap file. A session can override the OS, the hypervisor, the
+    whole command template, its time budget in seconds for every target ("duration", also settable for all the sessions)
+    and the capture filter ("filter", where {host} and {port} are replaced by the target). By default all the TCP
+    traffic is captured, e.g. also the one of a crawler towards the other hosts of a site, and every unit is run alone.
+    A session whose targets are the only hosts it talks to can be isolated ("isolate", also settable for all the
+    sessions): its traffic is captured with a filter on the address and port of every target, so it is run together
+    with the others, unless it also has a custom filter.
+
+    :param path: the name of the specification file
+    :return: the capture units
+    """
+
+    with open(path) as f:
+        spec = load(f)
+
+    units = []
+    for session in spec["sessions"]:
+        app = session["app"]
+        tool = session.get("tool", app.split("-")[0])
+        os = session.get("os", spec.get("os"))
+        hypervisor = session.get("hypervisor", spec.get("hypervisor", "none"))
+        if tool not in tools and "command" not in session:
+            raise ValueError("unknown tool %s" % tool)
+        if os is None or any("_" in i or "/" in i for i in (app, os, hypervisor)):
+            raise ValueError("invalid pcap name for %s" % app)
+        template = [*session.get("command", tools.get(tool, {}).get("command")), *session.get("arguments", [])]
+        duration = session.get("duration", tools.get(tool, {}).get("duration", spec.get("duration")))
+        isolate = session.get("isolate", spec.get("isolate", False))
+        default = "tcp and host {host} and port {port}" if isolate else "tcp"
+        for url in session["targets"]:
+            parts = urlsplit(url)
+            endpoint = (parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            values = {"url": url, "host": endpoint[0], "port": endpoint[1], "scratch": "{scratch}"}
+            units.append(Unit("%s_%s_%s.pcap" % (app, os, hypervisor), url, [i.format(**values) for i in template],
+                              endpoint, session.get("filter", default).format(**values),
+                              "filter" in session or not isolate, duration))
+
+    return units
+
+
+def loopback(host: str) -> bool:
+    """
+    Checks if a host is a loopback address.
+
+    :param host: the name or the address of the host
+    :return: True if the host is a loopback address or localhost
+    """
+
+    try:
+        return ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+async def capture(unit: Unit, pcap: str, scratch: str, tshark: Sequence[str], interface: Optional[str],
+                  linger: float) -> None:
+    """
+    Runs a capture unit.
+
+    :param unit: the capture unit
+    :param pcap: the name of the pcap file to write
+    :param scratch: the private temporary folder of the tool
+    :param tshark: the tshark command
+    :param interface: the network interface to sniff or None for the loopback one with a loopback target and the default
+                      one otherwise
+    :param linger: the seconds to keep capturing after the tool has ended
+    """
+
+    if interface is None and loopback(unit.endpoint[0]):
+        interface = "lo"
+    async with CaptureSession(pcap, unit.filter, tshark, interface) as session:
+        await session.start()
+        if not await session.run([i.replace("{scratch}", scratch) for i in unit.command], unit.duration):
+            print("%s %s: stopped after %g seconds" % (unit.pcap, unit.url, unit.duration))
+        await session.stop(linger)
+
+
+async def orchestrate(units: Sequence[Unit], folder: str, sessions: int = 8, tshark: Sequence[str] = ("tshark",),
+                      interface: Optional[str] = None, linger: float = 1) -> None:
+    """
+    Runs many capture units at the same time and merges the captures of every pcap file. Two units sharing a target
+    are never run at the same time, so that their capture filters never see each other's traffic.
+
+    :param units: the capture units
+    :param folder: the folder that will contain the produced pcap files
+    :param sessions: the maximum number of units to run at the same time
+    :param tshark: the tshark command
+    :param interface: the network interface to sniff or None for the loopback one with the loopback targets and the
+                      default one otherwise
+    :param linger: the seconds to keep capturing after every tool has ended
+    """
+
+    scratch = mkdtemp(prefix=".capture-", dir=folder)
+    pending = list(enumerate(units))
+    running: Dict[Task, Tuple[int, Unit]] = {}
+    parts: Dict[str, List[str]] = {}
+    left: Dict[str, int] = {}
+    for unit in units:
+        left[unit.pcap] = left.get(unit.pcap, 0) + 1
+
+    try:
+        while pending or running:
+            busy = {u.endpoint for _, u in running.values()}
+            exclusive = any(u.exclusive for _, u in running.values())
+            for index, unit in list(pending):
+                if len(running) >= sessions or exclusive or unit.exclusive and running:
+                    break
+                if unit.endpoint in busy:
+                    continue
+                print("%d) %s %s" % (index + 1, unit.pcap, unit.url))
+                pcap = "%s/%d.pcap" % (scratch, index)
+                task = ensure_future(capture(unit, pcap, mkdtemp(dir=scratch), tshark, interface, linger))
+                running[task] = (index, unit)
+                pending.remove((index, unit))
+                parts.setdefault(unit.pcap, []).append(pcap)
+                busy.add(unit.endpoint)
+                exclusive = unit.exclusive
+
+            done, _ = await wait(running, return_when=FIRST_COMPLETED)
+            for task in done:
+                _, unit = running.pop(task)
+                task.result()
+                left[unit.pcap] -= 1
+                if left[unit.pcap] == 0:
+                    await merge(parts[unit.pcap], "%s/%s" % (folder, unit.pcap))
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await wait(running)
+        rmtree(scratch)
+
+
+async def merge(parts: Sequence[str], pcap: str) -> None:
+    """
+    Merges some captures in chronological order.
+
+    :param parts: the names of the captures
+    :param pcap: the name of the merged capture
+    """
+
+    if len(parts) == 1:
+        replace(parts[0], pcap)
+    else:
+        process = await create_subprocess_exec("mergecap", "-F", "libpcap", "-w", pcap, *parts)
+        if await process.wait() != 0:
+            raise RuntimeError("mergecap failed with exit code %d on %s" % (process.returncode, pcap))
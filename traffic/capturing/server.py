@@ -0,0 +1,257 @@
+"""
+Stand-in web server stuff.
+"""
+from asyncio import IncompleteReadError
+from asyncio import LimitOverrunError
+from asyncio import StreamReader
+from asyncio import StreamWriter
+from asyncio import TimeoutError
+from asyncio import sleep
+from asyncio import start_server
+from asyncio import wait_for
+from random import Random
+from ssl import SSLContext
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from urllib.parse import urlsplit
+
+# The content types of the assets, cycled by the pages.
+_assets = [("css", "text/css"), ("js", "application/javascript"), ("png", "image/png")]
+_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout"}
+_block = 1 << 16
+
+
+class Resource(NamedTuple):
+    """
+    A resource of a site.
+    """
+
+    content_type: str
+    head: bytes
+    size: int
+    latency: float
+
+
+class Site:
+    """
+    A synthetic site, i.e. a tree of HTML pages, each one linking its parent, its children and some assets, with a
+    robots.txt and a sitemap.xml. The size and the latency of every resource are drawn from the profile ranges by a
+    random generator seeded by its path, so the same site is served at every run.
+    """
+
+    def __init__(self, pages: int = 1000, fanout: int = 5, assets: int = 3,
+                 sizes: Optional[Dict[str, Sequence[int]]] = None, latency: Sequence[float] = (0, 0), seed: int = 0):
+        """
+        Creates the site.
+
+        :param pages: the number of pages
+        :param fanout: the number of children of every page
+        :param assets: the number of assets of every page
+        :param sizes: the minimum and maximum sizes in bytes of the resources of every content type
+        :param latency: the minimum and maximum seconds to wait before sending a response
+        :param seed: the seed of the site
+        """
+
+        self.__pages = pages
+        self.__fanout = fanout
+        self.__assets = assets
+        self.__sizes = {"text/html": (2048, 65536), "text/css": (512, 16384), "application/javascript": (1024, 131072),
+                        "image/png": (1024, 262144)}
+        self.__sizes.update(sizes or {})
+        self.__latency = latency
+        self.__seed = seed
+
+    def __page(self, index: int) -> bytes:
+        """
+        Creates the markup of a page.
+
+        :param index: the page index
+        :return: the page markup, without its padding
+        """
+
+        links = []
+        if index > 0:
+            links.append("/p/%d.html" % ((index - 1) // self.__fanout))
+        links += ["/p/%d.html" % i for i in range(index * self.__fanout + 1,
+                                                  min(index * self.__fanout + self.__fanout + 1, self.__pages))]
+        assets = ["/a/%d-%d.%s" % (index, i, _assets[i % len(_assets)][0]) for i in range(self.__assets)]
+        html = ["<!DOCTYPE html>", "<html><head><title>Page %d</title>" % index]
+        html += ['<link rel="stylesheet" href="%s">' % i for i in assets if i.endswith(".css")]
+        html += ['<script src="%s"></script>' % i for i in assets if i.endswith(".js")]
+        html += ["</head><body>"]
+        html += ['<img src="%s">' % i for i in assets if i.endswith(".png")]
+        html += ['<a href="%s">%s</a>' % (i, i) for i in links]
+        html += ["</body></html>", ""]
+
+        return "\n".join(html).encode()
+
+    def resolve(self, path: str) -> Optional[Resource]:
+        """
+        Finds a resource.
+
+        :param path: the path of the resource, without the query
+        :return: the resource or None if it does not exist
+        """
+
+        head = b""
+        if path in ("/", "/index.html"):
+            content_type = "text/html"
+            head = self.__page(0)
+        elif path.startswith("/p/") and path.endswith(".html") and path[3:-5].isdigit():
+            if int(path[3:-5]) >= self.__pages:
+                return None
+            content_type = "text/html"
+            head = self.__page(int(path[3:-5]))
+        elif path.startswith("/a/") and "." in path:
+            page, _, name = path[3:].partition("-")
+            number, _, extension = name.partition(".")
+            if not page.isdigit() or int(page) >= self.__pages or not number.isdigit() or \
+                    int(number) >= self.__assets or _assets[int(number) % len(_assets)][0] != extension:
+                return None
+            content_type = _assets[int(number) % len(_assets)][1]
+        elif path == "/robots.txt":
+            return Resource("text/plain", b"User-agent: *\nAllow: /\nSitemap: /sitemap.xml\n", 0, 0)
+        elif path == "/sitemap.xml":
+            urls = "".join("<url><loc>/p/%d.html</loc></url>" % i for i in range(self.__pages))
+            sitemap = '<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>'
+            return Resource("application/xml", (sitemap % urls).encode(), 0, 0)
+        else:
+            return None
+
+        random = Random("%d %s" % (self.__seed, path))
+        size = max(random.randint(*self.__sizes[content_type]) - len(head), 0)
+
+        return Resource(content_type, head, size, random.uniform(*self.__latency))
+
+
+class StandInServer:
+    """
+    An HTTP/1.1 server for a synthetic site, able to keep thousands of slow connections open at the same time, as
+    needed by the slow DoS tools.
+    """
+
+    def __init__(self, site: Site, timeout: Optional[float] = None, rate: Optional[float] = None):
+        """
+        Creates the server.
+
+        :param site: the site to serve
+        :param timeout: the maximum seconds to wait for a request, a request body or a client to read a response block,
+                        or None to wait forever as a server vulnerable to slow DoS attacks
+        :param rate: the maximum bytes per second sent to every connection or None for no limit
+        """
+
+        self.__site = site
+        self.__timeout = timeout
+        self.__rate = rate
+
+    async def serve(self, host: Union[str, Sequence[str]], port: int, ssl: Optional[SSLContext] = None) -> None:
+        """
+        Serves the site forever.
+
+        :param host: the address or the addresses to listen on
+        :param port: the port to listen on
+        :param ssl: the TLS context for HTTPS or None for HTTP
+        """
+
+        server = await start_server(self.__handle, host, port, ssl=ssl, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    async def __read_body(self, reader: StreamReader, headers: Dict[str, str]) -> None:
+        """
+        Reads and discards the body of a request.
+
+        :param reader: the connection reader
+        :param headers: the request headers, with lowercase names
+        """
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await wait_for(reader.readline(), self.__timeout)).split(b";")[0], 16)
+                await wait_for(reader.readexactly(size + 2), self.__timeout)
+                if size == 0:
+                    return
+        else:
+            # Slow bodies (e.g. RUDY) are read a block at a time.
+            left = int(headers.get("content-length", "0"))
+            while left > 0:
+                data = await wait_for(reader.read(min(left, _block)), self.__timeout)
+                if not data:
+                    raise IncompleteReadError(b"", left)
+                left -= len(data)
+
+    async def __respond(self, writer: StreamWriter, status: int, resource: Optional[Resource], body: bool,
+                        keep_alive: bool) -> None:
+        """
+        Sends a response.
+
+        :param writer: the connection writer
+        :param status: the status code
+        :param resource: the resource or None for an empty response
+        :param body: False to only send the headers
+        :param keep_alive: True if the connection is kept open
+        """
+
+        content_type, head, size = (resource.content_type, resource.head, resource.size) if resource else \
+            ("text/plain", b"", 0)
+        headers = ["HTTP/1.1 %d %s" % (status, _reasons[status]), "Server: stand-in",
+                   "Content-Type: %s" % content_type, "Content-Length: %d" % (len(head) + size),
+                   "Connection: %s" % ("keep-alive" if keep_alive else "close"), "", ""]
+        writer.write("\r\n".join(headers).encode())
+        if body:
+            writer.write(head)
+            padding = b" " * min(size, _block)
+            while size > 0:
+                writer.write(padding[:size])
+                await wait_for(writer.drain(), self.__timeout)
+                if self.__rate is not None:
+                    await sleep(min(size, _block) / self.__rate)
+                size -= _block
+        await wait_for(writer.drain(), self.__timeout)
+
+    async def __handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Handles a connection.
+
+        :param reader: the connection reader
+        :param writer: the connection writer
+        """
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await wait_for(reader.readuntil(b"\r\n\r\n"), self.__timeout)
+                except TimeoutError:
+                    await self.__respond(writer, 408, None, True, False)
+                    return
+                lines: List[str] = request.decode("latin-1").split("\r\n")
+                parts: Tuple[str, ...] = tuple(lines[0].split(" "))
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(parts) != 3:
+                    await self.__respond(writer, 400, None, True, False)
+                    return
+                method, target, version = parts
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                await self.__read_body(reader, headers)
+                if method not in ("GET", "HEAD", "POST"):
+                    await self.__respond(writer, 405, None, True, keep_alive)
+                    continue
+                resource = self.__site.resolve(urlsplit(target).path)
+                if resource is not None and resource.latency > 0:
+                    await sleep(resource.latency)
+                await self.__respond(writer, 404 if resource is None else 200, resource, method != "HEAD", keep_alive)
+        except (ConnectionError, IncompleteReadError, LimitOverrunError, TimeoutError, ValueError):
+            pass
+        finally:
+            writer.close()
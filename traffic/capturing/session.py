@@ -0,0 +1,160 @@
+"""
+Capture session stuff.
+"""
+from asyncio import TimeoutError
+from asyncio import create_subprocess_exec
+from asyncio import ensure_future
+from asyncio import sleep
+from asyncio import wait_for
+from asyncio.subprocess import Process
+from os import killpg
+from signal import SIGINT
+from signal import SIGKILL
+from signal import SIGTERM
+from subprocess import DEVNULL
+from subprocess import PIPE
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+
+async def stop_group(process: Process, signal: int = SIGTERM, timeout: float = 10) -> None:
+    """
+    Stops the process group led by a process, killing it if it does not exit in time. A group that cannot be signalled,
+    e.g. because it belongs to root when the tool is started through sudo, is reported and still waited for up to the
+    timeout.
+
+    :param process: the process, started in its own session
+    :param signal: the signal to send to the group
+    :param timeout: the seconds to wait before killing the group, and then before giving up
+    """
+
+    if process.returncode is None:
+        try:
+            killpg(process.pid, signal)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            print("cannot signal the process group %d, waiting for it to exit" % process.pid)
+        try:
+            await wait_for(process.wait(), timeout)
+        except TimeoutError:
+            pass
+    # Kills whatever is left of the group, including the children that outlive the group leader.
+    try:
+        killpg(process.pid, SIGKILL)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        print("cannot kill the process group %d" % process.pid)
+    try:
+        await wait_for(process.wait(), timeout)
+    except TimeoutError:
+        raise RuntimeError("the process group %d did not exit" % process.pid)
+
+
+class CaptureSession:
+    """
+    A capture session, i.e. a tshark instance sniffing the traffic of a tool run. The sniffer and the tool are started
+    in their own process groups, so stopping a session never touches the processes of the other sessions sharing the
+    same machine.
+    """
+
+    def __init__(self, pcap: str, capture_filter: str, tshark: Sequence[str] = ("tshark",),
+                 interface: Optional[str] = None):
+        """
+        Creates the session.
+
+        :param pcap: the name of the pcap file to write
+        :param capture_filter: the capture filter
+        :param tshark: the tshark command
+        :param interface: the network interface to sniff or None for the default one
+        """
+
+        self.__pcap = pcap
+        self.__filter = capture_filter
+        self.__tshark = list(tshark)
+        self.__interface = interface
+        self.__sniffer: Optional[Process] = None
+        self.__tool: Optional[Process] = None
+        self.__messages: List[str] = []
+        self.__drain = None
+
+    async def __aenter__(self) -> "CaptureSession":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop(0)
+
+    async def start(self, timeout: float = 30) -> None:
+        """
+        Starts sniffing and waits until the capture is ready, i.e. until tshark reports that it is capturing.
+
+        :param timeout: the maximum seconds to wait
+        """
+
+        interfaces = [] if self.__interface is None else ["-i", self.__interface]
+        self.__sniffer = await create_subprocess_exec(*self.__tshark, *interfaces, "-q", "-F", "libpcap", "-w",
+                                                      self.__pcap, "-f", self.__filter, stdin=DEVNULL, stdout=DEVNULL,
+                                                      stderr=PIPE, start_new_session=True)
+
+        async def ready() -> bool:
+            async for line in self.__sniffer.stderr:
+                line = line.decode(errors="replace").strip()
+                if line.startswith("Capturing on"):
+                    return True
+                self.__messages.append(line)
+            return False
+
+        try:
+            started = await wait_for(ready(), timeout)
+        except TimeoutError:
+            started = False
+        if not started:
+            await stop_group(self.__sniffer)
+            raise RuntimeError("tshark did not start capturing: %s" % " ".join(self.__messages[-5:]))
+
+        # tshark keeps writing to its standard error, so it must be drained.
+        self.__drain = ensure_future(self.__sniffer.stderr.read())
+
+    async def run(self, command: Sequence[str], budget: Optional[float] = None) -> bool:
+        """
+        Runs a tool until it ends or its time budget expires, in which case its whole process group is stopped.
+
+        :param command: the tool command
+        :param budget: the maximum seconds the tool can run or None to wait until it ends
+        :return: True if the tool ended by itself, False if it has been stopped
+        """
+
+        self.__tool = await create_subprocess_exec(*command, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+                                                   start_new_session=True)
+        try:
+            await wait_for(self.__tool.wait(), budget)
+            ended = True
+        except TimeoutError:
+            ended = False
+        await stop_group(self.__tool)
+        self.__tool = None
+
+        return ended
+
+    async def stop(self, linger: float = 1, timeout: float = 10) -> None:
+        """
+        Stops the session. The tool is stopped if it is still running, then tshark is interrupted after the linger time
+        so that it captures the last packets of the tool and cleanly flushes and closes the pcap file.
+
+        :param linger: the seconds to keep capturing after the tool has ended
+        :param timeout: the maximum seconds to wait for tshark to exit before killing it
+        """
+
+        if self.__tool is not None:
+            await stop_group(self.__tool)
+            self.__tool = None
+        if self.__sniffer is not None:
+            if self.__sniffer.returncode is None and linger > 0:
+                await sleep(linger)
+            await stop_group(self.__sniffer, SIGINT, timeout)
+            if self.__drain is not None:
+                await self.__drain
+            self.__sniffer = None
+            self.__drain = None
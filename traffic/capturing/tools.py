@@ -0,0 +1,28 @@
+"""
+Traffic generation tools stuff.
+"""
+
+# The command templates of the supported tools, where {url}, {host} and {port} are replaced by the target and {scratch}
+# by a private temporary folder, and the default time limits in seconds of the tools that never end by themselves.
+# noinspection SpellCheckingInspection
+tools = {
+        "curl":         {"command": ["curl", "--silent", "--output", "/dev/null", "{url}"]},
+        "goldeneye":    {"command": ["python", "goldeneye/goldeneye.py", "{url}", "-w", "5", "-s", "5", "-m", "post"]},
+        "grab-site":    {"command": ["grab-site", "--dir", "{scratch}/grab-site", "{url}"], "duration": 5},
+        "httrack":      {"command": ["httrack", "{url}", "-O", "{scratch}", ""]},
+        "hulk":         {"command": ["python", "hulk/hulk.py", "{url}", "safe"]},
+        "rudy":         {"command": ["rudy", "-t", "{url}"]},
+        "slowhttptest": {"command": ["slowhttptest", "-u", "{url}"], "duration": 60},
+        "slowloris":    {"command": ["python3", "slowloris/slowloris.py", "-ua", "{url}"]},
+        "wget":         {"command": ["wget", "--quiet", "--recursive", "--output-document={scratch}/wget.tmp",
+                                     "{url}"]},
+        "wpull":        {"command": ["python3", "-m", "wpull", "{url}", "--warc-file", "{scratch}/tmp",
+                                     "--no-check-certificate", "--no-robots", "--user-agent",
+                                     "InconspiuousWebBrowser/1.0", "--wait", "0.5", "--random-wait", "--waitretry",
+                                     "600", "--page-requisites", "--recursive", "--level", "inf",
+                                     "--span-hosts-allow", "linked-pages,page-requisites", "--escaped-fragment",
+                                     "--strip-session-id", "--sitemaps", "--reject-regex", "/login\\.php", "--tries",
+                                     "3", "--retry-connrefused", "--retry-dns-error", "--timeout", "60",
+                                     "--session-timeout", "21600", "--delete-after", "--database", "{scratch}/tmp.db",
+                                     "--quiet", "--output-file", "{scratch}/tmp.log"]}
+}
@@ -0,0 +1,23 @@
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from shlex import split as split_command
+
+from capturing import load_spec
+from capturing import orchestrate
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Generates the pcap files described by a traffic specification")
+parser.add_argument("--sessions", type=int, default=8, help="the maximum number of tool sessions running at once")
+parser.add_argument("--tshark", default="tshark", help="the tshark command")
+parser.add_argument("--interface", default=None,
+                    help="the network interface to sniff (default: lo for the loopback targets, else the tshark one)")
+parser.add_argument("--linger", type=float, default=1, help="the seconds to keep capturing after every tool has ended")
+parser.add_argument("--folder", default=".", help="the folder that will contain the produced pcap files")
+parser.add_argument("spec", help="the name of the JSON traffic specification")
+args = parser.parse_args()
+
+# Captures the traffic.
+units = load_spec(args.spec)
+print("%d sessions" % len(units))
+get_event_loop().run_until_complete(orchestrate(units, args.folder, args.sessions, split_command(args.tshark),
+                                                args.interface, args.linger))
@@ -0,0 +1,16 @@
+"""
+Traffic processing stuff.
+"""
+
+from .columnar import ColumnarWriter
+from .flows import Flow
+from .flows import columns
+from .flows import extract
+from .flows import types
+from .flows import version
+from .pcap import StreamTracker
+from .pcap import decode
+from .pcap import open_capture
+from .pcap import truncate
+from .table import FlowTable
+from .table import track
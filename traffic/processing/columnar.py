@@ -0,0 +1,95 @@
+"""
+Columnar data set stuff.
+"""
+from json import dump
+from os import makedirs
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Sequence
+
+from numpy import array
+from numpy import memmap
+from pandas import DataFrame
+from pandas.api.types import is_bool_dtype
+from pandas.api.types import is_numeric_dtype
+
+# The number of codes remapped at once when finalizing a categorical column.
+_block = 1 << 24
+
+
+class ColumnarWriter:
+    """
+    Writes a data set in a columnar format that can be memory-mapped. A data set is a folder containing a meta.json file
+    and a raw <column>.bin file for every column. The meta.json file stores the number of rows and, for every column in
+    order, its name, its numpy dtype and, for the categorical columns, the sorted list of categories indexed by the codes
+    stored in the column file.
+    """
+
+    def __init__(self, path: str, doubles: Sequence[str] = ()):
+        """
+        Creates the writer.
+
+        :param path: the name of the data set folder
+        :param doubles: the numeric columns to store as float64, all the other numeric ones are stored as float32
+        """
+
+        makedirs(path, exist_ok=True)
+        self.__path = path
+        self.__doubles = set(doubles)
+        self.__rows = 0
+        self.__columns: List[Dict] = []
+        self.__files: List[BinaryIO] = []
+        self.__codes: List[Dict[str, int]] = []
+
+    def write(self, chunk: DataFrame) -> None:
+        """
+        Appends some rows to the data set.
+
+        :param chunk: the rows to write, with the same columns at every call
+        """
+
+        if not self.__columns:
+            for name, values in chunk.items():
+                if is_numeric_dtype(values) or is_bool_dtype(values):
+                    dtype = "<f8" if name in self.__doubles else "<f4"
+                else:
+                    dtype = "<i4"
+                self.__columns.append({"name": name, "dtype": dtype})
+                self.__files.append(open("%s/%s.bin" % (self.__path, name), "wb"))
+                self.__codes.append({})
+
+        for column, f, codes in zip(self.__columns, self.__files, self.__codes):
+            values = chunk[column["name"]]
+            if column["dtype"] == "<i4":
+                # The codes follow the order of appearance until the categories are sorted by close().
+                for i in values.unique():
+                    codes.setdefault(i, len(codes))
+                values = values.map(codes)
+            f.write(values.to_numpy(dtype=column["dtype"]).tobytes())
+        self.__rows += len(chunk)
+
+    def close(self) -> None:
+        """
+        Finalizes the data set by sorting the categories and writing the metadata.
+        """
+
+        for f in self.__files:
+            f.close()
+
+        for column, codes in zip(self.__columns, self.__codes):
+            if column["dtype"] != "<i4":
+                continue
+            categories = sorted(codes)
+            position = {k: v for v, k in enumerate(categories)}
+            mapping = array([position[i] for i in codes], dtype="<i4")
+            column["categories"] = categories
+            if self.__rows > 0 and len(codes) > 1:
+                values = memmap("%s/%s.bin" % (self.__path, column["name"]), dtype="<i4", mode="r+")
+                for i in range(0, self.__rows, _block):
+                    values[i:i + _block] = mapping[values[i:i + _block]]
+                values.flush()
+                del values
+
+        with open("%s/meta.json" % self.__path, "w") as f:
+            dump({"rows": self.__rows, "columns": self.__columns}, f)
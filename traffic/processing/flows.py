@@ -0,0 +1,358 @@
+"""
+Flow statistics stuff.
+"""
+from ipaddress import ip_address
+from ipaddress import ip_network
+from typing import Iterator
+from typing import List
+from typing import MutableSequence
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from .pcap import ACK
+from .pcap import FIN
+from .pcap import RST
+from .pcap import SYN
+from .pcap import Segment
+from .pcap import StreamTracker
+from .pcap import decode
+from .pcap import open_capture
+
+# The columns of the tstat log_tcp_complete and log_tcp_nocomplete files that end up in the data sets.
+# noinspection SpellCheckingInspection
+columns = ["c_ip", "c_port", "c_pkts_all", "c_rst_cnt", "c_ack_cnt", "c_ack_cnt_p", "c_bytes_uniq", "c_pkts_data",
+           "c_bytes_all", "c_pkts_retx", "c_bytes_retx", "c_pkts_ooo", "c_syn_cnt", "c_fin_cnt", "s_ip", "s_port",
+           "s_pkts_all", "s_rst_cnt", "s_ack_cnt", "s_ack_cnt_p", "s_bytes_uniq", "s_pkts_data", "s_bytes_all",
+           "s_pkts_retx", "s_bytes_retx", "s_pkts_ooo", "s_syn_cnt", "s_fin_cnt", "first", "last", "durat", "c_first",
+           "s_first", "c_last", "s_last", "c_first_ack", "s_first_ack", "c_isint", "s_isint", "c_iscrypto",
+           "s_iscrypto", "con_t", "p2p_t", "http_t"]
+
+# The types of the columns: addresses are strings, times are floats and everything else is an integer.
+types = {i: str for i in ["c_ip", "s_ip"]}
+types.update({i: float for i in ["first", "last", "durat", "c_first", "s_first", "c_last", "s_last", "c_first_ack",
+                                 "s_first_ack"]})
+types.update({i: int for i in columns if i not in types})
+
+# The version of the extractor, to be bumped every time its output changes.
+version = 1
+
+# The tstat connection types.
+CON_HTTP = 1
+CON_TLS = 8192
+
+# The indices of the per-direction counters.
+PKTS_ALL = 0
+RST_CNT = 1
+ACK_CNT = 2
+ACK_CNT_P = 3
+BYTES_UNIQ = 4
+PKTS_DATA = 5
+BYTES_ALL = 6
+PKTS_RETX = 7
+BYTES_RETX = 8
+PKTS_OOO = 9
+SYN_CNT = 10
+FIN_CNT = 11
+
+# The indices of the per-direction times.
+FIRST_DATA = 0
+LAST_DATA = 1
+FIRST_ACK = 2
+
+_methods = (b"GET ", b"POST ", b"HEAD ", b"PUT ", b"DELETE ", b"OPTIONS ", b"CONNECT ", b"TRACE ", b"PATCH ")
+
+
+def track_sequence(high: int, hole_start: int, hole_end: int, seq: int,
+                   length: int) -> Tuple[int, int, int, int, int, bool]:
+    """
+    Tracks the relative sequence number of a segment carrying some payload. Only the most recent hole in the sequence
+    space is remembered: a segment that fills it is out of sequence, while a segment below the highest sequence number
+    seen so far that does not fill it is a retransmission.
+
+    :param high: the highest relative sequence number seen so far or -1 if no payload has been seen yet
+    :param hole_start: the start of the hole
+    :param hole_end: the end of the hole, equal to its start if there is no hole
+    :param seq: the relative sequence number of the segment
+    :param length: the length of the payload
+    :return: a tuple with the updated high, hole start and hole end, the number of unique bytes, the number of
+             retransmitted bytes and if the segment was out of sequence
+    """
+
+    end = seq + length
+    if high < 0 or seq == high:
+        return end, hole_start, hole_end, length, 0, False
+    elif seq > high:
+        return end, high, seq, length, 0, False
+    elif end > high:
+        return end, hole_start, hole_end, end - high, high - seq, False
+    elif hole_start <= seq and end <= hole_end and hole_start < hole_end:
+        if seq == hole_start:
+            hole_start = end
+        elif end == hole_end:
+            hole_end = seq
+        return high, hole_start, hole_end, length, 0, True
+    else:
+        return high, hole_start, hole_end, 0, length, False
+
+
+def connection_type(payload: bytes) -> int:
+    """
+    Guesses the tstat connection type of a flow from the first payload it carries.
+
+    :param payload: the payload
+    :return: the connection type
+    """
+
+    if payload.startswith(_methods) or payload.startswith(b"HTTP/"):
+        return CON_HTTP
+    elif len(payload) > 1 and payload[0] == 0x16 and payload[1] == 0x03:
+        return CON_TLS
+    else:
+        return 0
+
+
+def update_direction(counters: MutableSequence[int], sequence: MutableSequence[int], times: MutableSequence[int],
+                     segment: Segment, time: int) -> bool:
+    """
+    Updates the statistics of one direction of a flow with a segment. The statistics can be lists or array rows, so that
+    both `Flow` and `FlowTable` share the same logic.
+
+    :param counters: the counters of the direction
+    :param sequence: the base, the high, the hole start and the hole end of the relative sequence numbers of the
+                     direction, where a base of -1 means unknown
+    :param times: the timestamps of the first payload, of the last payload and of the first ACK of the direction, where
+                  -1 means unset
+    :param segment: the segment
+    :param time: the timestamp of the segment
+    :return: True if the segment carries the first payload of the direction
+    """
+
+    flags = segment.flags
+    length = segment.length
+
+    counters[PKTS_ALL] += 1
+    if flags & RST:
+        counters[RST_CNT] = 1
+    if flags & ACK:
+        counters[ACK_CNT] += 1
+        if length == 0:
+            counters[ACK_CNT_P] += 1
+        if not flags & SYN and times[FIRST_ACK] < 0:
+            times[FIRST_ACK] = time
+    if flags & SYN:
+        counters[SYN_CNT] += 1
+    if flags & FIN:
+        counters[FIN_CNT] += 1
+
+    if flags & SYN and sequence[0] < 0:
+        sequence[0] = segment.seq + 1
+    if length == 0:
+        return False
+    if sequence[0] < 0:
+        sequence[0] = segment.seq
+    seq = (segment.seq - int(sequence[0])) & 0xffffffff
+    sequence[1], sequence[2], sequence[3], unique, retransmitted, ooo = track_sequence(
+            int(sequence[1]), int(sequence[2]), int(sequence[3]), seq, length)
+    counters[PKTS_DATA] += 1
+    counters[BYTES_ALL] += length
+    counters[BYTES_UNIQ] += unique
+    if retransmitted:
+        counters[PKTS_RETX] += 1
+        counters[BYTES_RETX] += retransmitted
+    if ooo:
+        counters[PKTS_OOO] += 1
+    times[LAST_DATA] = time
+    if times[FIRST_DATA] < 0:
+        times[FIRST_DATA] = time
+        return True
+    else:
+        return False
+
+
+def is_complete(counters: Sequence[Sequence[int]]) -> bool:
+    """
+    Checks if a flow is complete, i.e. if both SYNs have been seen and it has been closed by both FINs or a RST.
+
+    :param counters: the counters of both directions of the flow
+    :return: True if the flow is complete
+    """
+
+    c = counters[0]
+    s = counters[1]
+
+    return bool(c[SYN_CNT] > 0 and s[SYN_CNT] > 0 and (c[FIN_CNT] > 0 and s[FIN_CNT] > 0 or
+                                                       c[RST_CNT] + s[RST_CNT] > 0))
+
+
+def address_columns(c_ip: bytes, s_ip: bytes, internal: Sequence) -> List[str]:
+    """
+    Computes the address columns of a flow.
+
+    :param c_ip: the packed client address
+    :param s_ip: the packed server address
+    :param internal: the internal networks
+    :return: the values of the c_ip, s_ip, c_isint and s_isint columns
+    """
+
+    c_ip = ip_address(c_ip)
+    s_ip = ip_address(s_ip)
+
+    return [str(c_ip), str(s_ip), "1" if any(c_ip in i for i in internal) else "0",
+            "1" if any(s_ip in i for i in internal) else "0"]
+
+
+def flow_row(addresses: Sequence[str], ports: Sequence[int], counters: Sequence[Sequence[int]], first: int, last: int,
+             times: Sequence[Sequence[int]], con_t: int, resolution: int) -> List[str]:
+    """
+    Computes the tstat log row of a flow.
+
+    :param addresses: the address columns of the flow, as computed by `address_columns()`
+    :param ports: the client and the server ports
+    :param counters: the counters of both directions
+    :param first: the timestamp of the first segment
+    :param last: the timestamp of the last segment
+    :param times: the per-direction times of both directions, where -1 means unset
+    :param con_t: the connection type
+    :param resolution: the number of timestamp ticks per second
+    :return: the values of all the `columns`
+    """
+
+    scale = 1000 / resolution
+    c = times[0]
+    s = times[1]
+
+    def relative(time: int) -> str:
+        return "%f" % ((time - first) * scale) if time >= 0 else "0"
+
+    return [addresses[0], str(ports[0]), *map(str, counters[0]), addresses[1], str(ports[1]), *map(str, counters[1]),
+            "%f" % (first * scale), "%f" % (last * scale), "%f" % ((last - first) * scale),
+            relative(c[FIRST_DATA]), relative(s[FIRST_DATA]), relative(c[LAST_DATA]), relative(s[LAST_DATA]),
+            relative(c[FIRST_ACK]), relative(s[FIRST_ACK]), addresses[2], addresses[3], "0", "0", str(con_t), "0", "0"]
+
+
+class Flow:
+    """
+    The tstat-like statistics of a TCP flow, i.e. the connection opened by a SYN segment.
+    """
+
+    __slots__ = ("c_ip", "c_port", "s_ip", "s_port", "first", "last", "counters", "sequences", "times", "con_t",
+                 "next")
+
+    def __init__(self, segment: Segment, time: int):
+        """
+        Creates the flow.
+
+        :param segment: the SYN segment opening the flow
+        :param time: the timestamp of the segment
+        """
+
+        self.c_ip = segment.src
+        self.c_port = segment.sport
+        self.s_ip = segment.dst
+        self.s_port = segment.dport
+        self.first = time
+        self.last = time
+        self.counters = [[0] * 12, [0] * 12]
+        # Base, high, hole start and hole end of the relative sequence numbers in each direction.
+        self.sequences = [[segment.seq + 1, -1, 0, 0], [-1, -1, 0, 0]]
+        self.times = [[-1] * 3, [-1] * 3]
+        self.con_t = 0
+        # The index of the next threshold to snapshot.
+        self.next = 0
+
+    def update(self, segment: Segment, time: int) -> None:
+        """
+        Updates the statistics with a segment.
+
+        :param segment: the segment
+        :param time: the timestamp of the segment
+        """
+
+        direction = 0 if segment.src == self.c_ip and segment.sport == self.c_port else 1
+        self.last = time
+        if update_direction(self.counters[direction], self.sequences[direction], self.times[direction], segment,
+                            time) and self.con_t == 0:
+            self.con_t = connection_type(segment.payload)
+
+    def complete(self) -> bool:
+        """
+        Checks if the flow is complete.
+
+        :return: True if the flow is complete
+        """
+
+        return is_complete(self.counters)
+
+    def row(self, resolution: int, internal: Sequence) -> List[str]:
+        """
+        Computes the tstat log row of the flow.
+
+        :param resolution: the number of timestamp ticks per second
+        :param internal: the internal networks
+        :return: the values of all the `columns`
+        """
+
+        return flow_row(address_columns(self.c_ip, self.s_ip, internal), (self.c_port, self.s_port), self.counters,
+                        self.first, self.last, self.times, self.con_t, resolution)
+
+
+def extract(path: str, thresholds: Sequence[float],
+            internal: Sequence[str] = ()) -> Iterator[Tuple[Optional[int], List[str], bool]]:
+    """
+    Computes the tstat-like statistics of every TCP flow in a capture by reading it only once. Besides the statistics of
+    the whole flows, a snapshot is emitted for every time threshold, containing the statistics of the flow truncated at
+    that threshold, just as if tstat was run on the output of `truncate()`.
+
+    Only the flows opened by a SYN are reported, as tstat does. The counters and the times follow the tstat definitions,
+    whereas the connection type is only guessed from the first payload and the crypto, P2P and HTTP types are always 0.
+
+    :param path: the name of the capture file
+    :param thresholds: the time thresholds in seconds
+    :param internal: the internal networks, used for the c_isint and s_isint columns
+    :return: an iterator of tuples with the index of the threshold (None for the whole flows), the values of all the
+             `columns` and if the flow is complete
+    """
+
+    # Same precision of the tshark filters used for the truncation.
+    limits = [float("%f" % i) for i in thresholds]
+    order = sorted(range(len(limits)), key=limits.__getitem__)
+    limits = [limits[i] for i in order]
+    count = len(limits)
+    internal = [ip_network(i) for i in internal]
+
+    def finish(flow: Flow) -> Iterator[Tuple[Optional[int], List[str], bool]]:
+        row = flow.row(resolution, internal)
+        complete = flow.complete()
+        for i in range(flow.next, count):
+            yield order[i], row, complete
+        yield None, row, complete
+
+    with open_capture(path) as reader:
+        link_type = reader.link_type
+        resolution = reader.resolution
+        tracker = StreamTracker()
+        flows = {}
+        for time, _, data in reader:
+            segment = decode(link_type, data)
+            if segment is None:
+                continue
+            stream, start = tracker.track(segment, time)
+            flow = flows.get(stream)
+            if flow is None:
+                if segment.flags & (SYN | ACK) != SYN:
+                    continue
+                flow = Flow(segment, time)
+                flows[stream] = flow
+
+            relative = (time - start) / resolution
+            if flow.next < count and limits[flow.next] < relative:
+                row = flow.row(resolution, internal)
+                complete = flow.complete()
+                while flow.next < count and limits[flow.next] < relative:
+                    yield order[flow.next], row, complete
+                    flow.next += 1
+            flow.update(segment, time)
+
+        for flow in flows.values():
+            yield from finish(flow)
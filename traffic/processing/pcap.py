@@ -0,0 +1,288 @@
+"""
+Pcap stuff.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from struct import Struct
+from subprocess import DEVNULL
+from subprocess import PIPE
+from subprocess import Popen
+from sys import stdin
+from typing import BinaryIO
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+# The TCP flags.
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+
+_ipv4 = Struct("!BBHHHBBH4s4s")
+_tcp = Struct("!HHIIBB")
+_magics = {
+        b"\xd4\xc3\xb2\xa1": ("<", 1000000),
+        b"\x4d\x3c\xb2\xa1": ("<", 1000000000),
+        b"\xa1\xb2\xc3\xd4": (">", 1000000),
+        b"\xa1\xb2\x3c\x4d": (">", 1000000000)
+}
+_ipv6_extensions = {0, 43, 44, 60}
+
+
+class Segment(NamedTuple):
+    """
+    A decoded TCP segment.
+    """
+
+    src: bytes
+    sport: int
+    dst: bytes
+    dport: int
+    seq: int
+    ack: int
+    flags: int
+    length: int
+    payload: bytes
+
+
+class PcapReader:
+    """
+    A minimal reader for libpcap capture files.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        """
+        Creates the reader.
+
+        :param stream: the binary stream to read, positioned at the beginning of the capture
+        """
+
+        self.header = stream.read(24)
+        if self.header[:4] not in _magics:
+            raise ValueError("not a libpcap capture")
+        endian, self.resolution = _magics[self.header[:4]]
+        self.link_type = Struct(endian + "I").unpack(self.header[20:24])[0] & 0xffff
+
+        self.__stream = stream
+        self.__record = Struct(endian + "IIII")
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes, bytes]]:
+        """
+        Iterates over the packets.
+
+        :return: an iterator of tuples with the timestamp in ticks of `resolution`, the raw record header and the data
+        """
+
+        read = self.__stream.read
+        unpack = self.__record.unpack
+        resolution = self.resolution
+        while True:
+            header = read(16)
+            if len(header) < 16:
+                return
+            seconds, fraction, captured, _ = unpack(header)
+            data = read(captured)
+            if len(data) < captured:
+                return
+            yield seconds * resolution + fraction, header, data
+
+
+@contextmanager
+def open_capture(path: str) -> Iterator[PcapReader]:
+    """
+    Opens a capture file for reading. Captures that are not in the libpcap format (e.g. pcapng) are converted on the fly
+    by piping them through tshark.
+
+    :param path: the name of the capture file or "-" for the standard input
+    :return: the capture reader
+    """
+
+    if path == "-":
+        yield PcapReader(stdin.buffer)
+        return
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        f.seek(0)
+        if magic in _magics:
+            yield PcapReader(f)
+            return
+
+    process = Popen(["tshark", "-r", path, "-F", "libpcap", "-w", "-"], stdout=PIPE, stderr=DEVNULL)
+    try:
+        yield PcapReader(process.stdout)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def decode(link_type: int, data: bytes) -> Optional[Segment]:
+    """
+    Decodes a TCP segment.
+
+    :param link_type: the link type of the capture
+    :param data: the raw frame
+    :return: the decoded segment or None if the frame is not a TCP segment
+    """
+
+    # Link layer.
+    if link_type == 1:
+        ether_type = data[12:14]
+        offset = 14
+        while ether_type in (b"\x81\x00", b"\x88\xa8"):
+            ether_type = data[offset + 2:offset + 4]
+            offset += 4
+        version = 4 if ether_type == b"\x08\x00" else 6 if ether_type == b"\x86\xdd" else 0
+    elif link_type == 113:
+        ether_type = data[14:16]
+        offset = 16
+        version = 4 if ether_type == b"\x08\x00" else 6 if ether_type == b"\x86\xdd" else 0
+    elif link_type == 276:
+        ether_type = data[0:2]
+        offset = 20
+        version = 4 if ether_type == b"\x08\x00" else 6 if ether_type == b"\x86\xdd" else 0
+    elif link_type in (0, 108):
+        family = int.from_bytes(data[0:4], "little" if link_type == 0 else "big")
+        if family not in (2, 24, 28, 30):
+            family = int.from_bytes(data[0:4], "big")
+        offset = 4
+        version = 4 if family == 2 else 6 if family in (24, 28, 30) else 0
+    elif link_type in (101, 12, 14):
+        offset = 0
+        version = data[0] >> 4 if data else 0
+    elif link_type == 228:
+        offset = 0
+        version = 4
+    elif link_type == 229:
+        offset = 0
+        version = 6
+    else:
+        return None
+
+    # Network layer.
+    if version == 4:
+        if len(data) < offset + 20:
+            return None
+        ihl, _, total, _, fragment, _, protocol, _, src, dst = _ipv4.unpack_from(data, offset)
+        if protocol != 6 or fragment & 0x1fff:
+            return None
+        end = offset + total
+        offset += (ihl & 0x0f) * 4
+    elif version == 6:
+        if len(data) < offset + 40:
+            return None
+        protocol = data[offset + 6]
+        end = offset + 40 + int.from_bytes(data[offset + 4:offset + 6], "big")
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        offset += 40
+        while protocol in _ipv6_extensions:
+            if len(data) < offset + 8:
+                return None
+            if protocol == 44:
+                if int.from_bytes(data[offset + 2:offset + 4], "big") & 0xfff8:
+                    return None
+                size = 8
+            else:
+                size = (data[offset + 1] + 1) * 8
+            protocol = data[offset]
+            offset += size
+        if protocol != 6:
+            return None
+    else:
+        return None
+
+    # Transport layer.
+    if len(data) < offset + 14:
+        return None
+    sport, dport, seq, ack, header, flags = _tcp.unpack_from(data, offset)
+    start = offset + (header >> 4) * 4
+
+    return Segment(src, sport, dst, dport, seq, ack, flags, max(end - start, 0), data[start:end])
+
+
+class StreamTracker:
+    """
+    Mimics the TCP stream indexing of Wireshark (i.e. the `tcp.stream` field): segments are grouped by their unordered
+    address/port pair, and a new SYN on a pair whose stream has already been closed starts a new stream.
+    """
+
+    def __init__(self):
+        """
+        Creates the tracker.
+        """
+
+        self.__streams = {}
+        self.__count = 0
+
+    def track(self, segment: Segment, time: int) -> Tuple[int, int]:
+        """
+        Tracks a segment.
+
+        :param segment: the segment to track
+        :param time: the timestamp of the segment
+        :return: a tuple where the first element is the stream index and the second the timestamp of its first segment
+        """
+
+        a = (segment.src, segment.sport)
+        b = (segment.dst, segment.dport)
+        key = (a, b) if a < b else (b, a)
+        flags = segment.flags
+        opening = flags & (SYN | ACK) == SYN
+        stream: Optional[List] = self.__streams.get(key)
+
+        if stream is None or (opening and stream[3] and segment.seq != stream[2]):
+            stream = [self.__count, time, segment.seq if opening else None, False]
+            self.__streams[key] = stream
+            self.__count += 1
+        if flags & (FIN | RST):
+            stream[3] = True
+
+        return stream[0], stream[1]
+
+
+def truncate(path: str, thresholds: Sequence[float], outputs: Sequence[Union[str, BinaryIO]]) -> None:
+    """
+    Truncates every TCP stream of a capture at several time thresholds by reading the capture only once. The output for
+    a threshold T contains the same packets as `tshark -r path -w output -Y "tcp.time_relative <= T"`.
+
+    :param path: the name of the capture file
+    :param thresholds: the time thresholds in seconds
+    :param outputs: the names of the truncated capture files or binary files open for writing, one for every threshold,
+                    that are closed once written
+    """
+
+    # tshark sees the thresholds with the precision of the "%f" format.
+    limits = [float("%f" % i) for i in thresholds]
+    order = sorted(range(len(limits)), key=limits.__getitem__)
+    limits = [limits[i] for i in order]
+
+    with open_capture(path) as reader:
+        files = [open(outputs[i], "wb") if isinstance(outputs[i], str) else outputs[i] for i in order]
+        try:
+            for f in files:
+                f.write(reader.header)
+
+            tracker = StreamTracker()
+            link_type = reader.link_type
+            resolution = reader.resolution
+            count = len(files)
+            for time, header, data in reader:
+                segment = decode(link_type, data)
+                if segment is None:
+                    continue
+                _, first = tracker.track(segment, time)
+                start = bisect_left(limits, (time - first) / resolution)
+                if start < count:
+                    record = header + data
+                    for f in files[start:]:
+                        f.write(record)
+        finally:
+            for f in files:
+                f.close()
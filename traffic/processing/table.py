@@ -0,0 +1,336 @@
+"""
+Flow table stuff.
+"""
+from ipaddress import ip_network
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from numpy import argpartition
+from numpy import array
+from numpy import flatnonzero
+from numpy import int16
+from numpy import int32
+from numpy import int64
+from numpy import minimum
+from numpy import uint16
+from numpy import uint8
+from numpy import where
+from numpy import zeros
+
+from .flows import PKTS_ALL
+from .flows import address_columns
+from .flows import connection_type
+from .flows import flow_row
+from .flows import is_complete
+from .flows import update_direction
+from .pcap import ACK
+from .pcap import FIN
+from .pcap import RST
+from .pcap import SYN
+from .pcap import Segment
+from .pcap import decode
+from .pcap import open_capture
+
+# The slot states.
+_USED = 1
+_CLOSED = 2
+
+# The indices of the per-flow times.
+_FIRST = 0
+_LAST = 1
+
+
+class FlowTable:
+    """
+    A table tracking the tstat-like statistics of the TCP flows of a packet stream in fixed-size arrays, so that its
+    memory usage is bounded by its capacity whatever the traffic. A flow is opened by a SYN (the other packets of
+    unknown flows are ignored) and it is emitted:
+
+    + as a snapshot, every time it crosses one of the packet count or time thresholds;
+    + when it ends, i.e. when it has been closed and no packet has been seen for the close timeout, or when a new SYN
+      reuses its addresses and ports;
+    + when it is idle for longer than the idle timeout or it has lasted longer than the active timeout;
+    + when it is evicted because the table is full, in which case the least recently seen flows are dropped.
+
+    The statistics are the same computed by `extract()`.
+    """
+
+    def __init__(self, resolution: int, capacity: int = 1 << 20, idle_timeout: float = 60, close_timeout: float = 1,
+                 active_timeout: float = 3600, packets: Sequence[int] = (), times: Sequence[float] = (),
+                 internal: Sequence[str] = ()):
+        """
+        Creates the table.
+
+        :param resolution: the number of timestamp ticks per second
+        :param capacity: the maximum number of flows tracked at once
+        :param idle_timeout: the seconds without packets after which a flow is emitted and dropped
+        :param close_timeout: the seconds without packets after which a closed flow is emitted and dropped
+        :param active_timeout: the seconds after which a flow is emitted and dropped
+        :param packets: the packet count thresholds
+        :param times: the time thresholds in seconds
+        :param internal: the internal networks, used for the c_isint and s_isint columns
+        """
+
+        self.__resolution = resolution
+        self.__capacity = capacity
+        self.__idle = int(idle_timeout * resolution)
+        self.__close = int(close_timeout * resolution)
+        self.__active = int(active_timeout * resolution)
+        self.__packets = sorted(packets)
+        # Same precision of the time thresholds of the data sets.
+        self.__times = sorted(float("%f" % i) for i in times)
+        self.__limits = array(self.__times + [float("inf")])
+        self.__internal = [ip_network(i) for i in internal]
+
+        self.__state = zeros(capacity, dtype=uint8)
+        self.__counters = zeros((capacity, 2, 12), dtype=int64)
+        # Base, high, hole start and hole end of the relative sequence numbers in each direction, where a base of -1
+        # means unknown.
+        self.__sequences = zeros((capacity, 2, 4), dtype=int64)
+        self.__clock = zeros((capacity, 2), dtype=int64)
+        # The per-direction times, where -1 means unset.
+        self.__directions = zeros((capacity, 2, 3), dtype=int64)
+        self.__ports = zeros((capacity, 2), dtype=uint16)
+        self.__isn = zeros(capacity, dtype=int64)
+        self.__con_t = zeros(capacity, dtype=int32)
+        self.__next_time = zeros(capacity, dtype=int16)
+        self.__next_packets = zeros(capacity, dtype=int16)
+        self.__addresses: List[Optional[Tuple[bytes, bytes]]] = [None] * capacity
+        # The address columns of the flows, computed at their first emission.
+        self.__names: List[Optional[List[str]]] = [None] * capacity
+        self.__slots = {}
+        self.__free = list(range(capacity - 1, -1, -1))
+        self.__emitted: List[Tuple[str, List[str], bool]] = []
+
+    def __len__(self) -> int:
+        """
+        Counts the tracked flows.
+
+        :return: the number of tracked flows
+        """
+
+        return len(self.__slots)
+
+    def pop(self) -> List[Tuple[str, List[str], bool]]:
+        """
+        Removes the flows emitted so far.
+
+        :return: a list of tuples with the reason of the emission (time, packets, end, idle, active, evicted or flush),
+                 the values of all the `columns` and if the flow is complete
+        """
+
+        emitted = self.__emitted
+        self.__emitted = []
+
+        return emitted
+
+    def __key(self, slot: int) -> Tuple[Tuple[bytes, int], Tuple[bytes, int]]:
+        """
+        Computes the key of a flow.
+
+        :param slot: the slot of the flow
+        :return: the unordered address/port pair of the flow
+        """
+
+        a = (self.__addresses[slot][0], int(self.__ports[slot, 0]))
+        b = (self.__addresses[slot][1], int(self.__ports[slot, 1]))
+
+        return (a, b) if a < b else (b, a)
+
+    def __row(self, slot: int) -> List[str]:
+        """
+        Computes the tstat log row of a flow.
+
+        :param slot: the slot of the flow
+        :return: the values of all the `columns`
+        """
+
+        addresses = self.__names[slot]
+        if addresses is None:
+            addresses = address_columns(self.__addresses[slot][0], self.__addresses[slot][1], self.__internal)
+            self.__names[slot] = addresses
+        first, last = self.__clock[slot].tolist()
+
+        return flow_row(addresses, self.__ports[slot].tolist(), self.__counters[slot].tolist(), first, last,
+                        self.__directions[slot].tolist(), int(self.__con_t[slot]), self.__resolution)
+
+    def __emit(self, slot: int, reason: str) -> None:
+        """
+        Emits a flow.
+
+        :param slot: the slot of the flow
+        :param reason: the reason of the emission
+        """
+
+        self.__emitted.append((reason, self.__row(slot), is_complete(self.__counters[slot].tolist())))
+
+    def __drop(self, slot: int, reason: str) -> None:
+        """
+        Emits a flow and frees its slot.
+
+        :param slot: the slot of the flow
+        :param reason: the reason of the emission
+        """
+
+        self.__emit(slot, reason)
+        del self.__slots[self.__key(slot)]
+        self.__state[slot] = 0
+        self.__addresses[slot] = None
+        self.__names[slot] = None
+        self.__free.append(slot)
+
+    def __allocate(self, segment: Segment, time: int) -> int:
+        """
+        Allocates the slot of a new flow, evicting the least recently seen flows if the table is full.
+
+        :param segment: the SYN segment opening the flow
+        :param time: the timestamp of the segment
+        :return: the slot
+        """
+
+        if not self.__free:
+            # Evicting a batch of flows at once amortizes the search for the least recently seen ones.
+            count = max(self.__capacity // 16, 1)
+            last = where(self.__state & _USED, self.__clock[:, _LAST], time + 1)
+            for slot in argpartition(last, count - 1)[:count].tolist():
+                self.__drop(slot, "evicted")
+
+        slot = self.__free.pop()
+        self.__state[slot] = _USED
+        self.__counters[slot] = 0
+        self.__sequences[slot] = 0
+        self.__sequences[slot, 0, 0] = segment.seq + 1
+        self.__sequences[slot, 1, 0] = -1
+        self.__sequences[slot, :, 1] = -1
+        self.__clock[slot] = time
+        self.__directions[slot] = -1
+        self.__ports[slot] = (segment.sport, segment.dport)
+        self.__isn[slot] = segment.seq
+        self.__con_t[slot] = 0
+        self.__next_time[slot] = 0
+        self.__next_packets[slot] = 0
+        self.__addresses[slot] = (segment.src, segment.dst)
+
+        return slot
+
+    def update(self, segment: Segment, time: int) -> None:
+        """
+        Updates the table with a segment.
+
+        :param segment: the segment
+        :param time: the timestamp of the segment
+        """
+
+        a = (segment.src, segment.sport)
+        b = (segment.dst, segment.dport)
+        key = (a, b) if a < b else (b, a)
+        flags = segment.flags
+        opening = flags & (SYN | ACK) == SYN
+        slot = self.__slots.get(key)
+
+        # Same logic of the stream tracking: a new SYN on a closed flow starts a new one.
+        if slot is not None and opening and self.__state[slot] & _CLOSED and segment.seq != self.__isn[slot]:
+            self.__drop(slot, "end")
+            slot = None
+        if slot is None:
+            if not opening:
+                return
+            slot = self.__allocate(segment, time)
+            self.__slots[key] = slot
+
+        # The time snapshots contain the packets up to their thresholds.
+        relative = (time - int(self.__clock[slot, _FIRST])) / self.__resolution
+        while self.__limits[self.__next_time[slot]] < relative:
+            self.__emit(slot, "time")
+            self.__next_time[slot] += 1
+
+        direction = 0 if segment.src == self.__addresses[slot][0] and segment.sport == self.__ports[slot, 0] else 1
+        self.__clock[slot, _LAST] = time
+        if flags & (FIN | RST):
+            self.__state[slot] |= _CLOSED
+        if update_direction(self.__counters[slot, direction], self.__sequences[slot, direction],
+                            self.__directions[slot, direction], segment, time) and self.__con_t[slot] == 0:
+            self.__con_t[slot] = connection_type(segment.payload)
+
+        # The packet snapshots contain the packets up to their thresholds.
+        packets = int(self.__counters[slot, 0, PKTS_ALL]) + int(self.__counters[slot, 1, PKTS_ALL])
+        while self.__next_packets[slot] < len(self.__packets) and self.__packets[self.__next_packets[slot]] <= packets:
+            self.__emit(slot, "packets")
+            self.__next_packets[slot] += 1
+
+    def expire(self, time: int) -> None:
+        """
+        Emits the time snapshots that are due and drops the ended, idle and expired flows.
+
+        :param time: the current timestamp
+        """
+
+        used = (self.__state & _USED).astype(bool)
+        closed = (self.__state & _CLOSED).astype(bool)
+        first = self.__clock[:, _FIRST]
+        last = self.__clock[:, _LAST]
+
+        relative = (time - first) / self.__resolution
+        for slot in flatnonzero(used & (self.__limits[minimum(self.__next_time, len(self.__times))] < relative)):
+            while self.__limits[self.__next_time[slot]] < relative[slot]:
+                self.__emit(slot, "time")
+                self.__next_time[slot] += 1
+
+        for slot in flatnonzero(used & closed & (time - last > self.__close)).tolist():
+            self.__drop(slot, "end")
+        for slot in flatnonzero(used & ~closed & (time - last > self.__idle)).tolist():
+            self.__drop(slot, "idle")
+        for slot in flatnonzero(used & (time - first > self.__active)).tolist():
+            if self.__state[slot]:
+                self.__drop(slot, "active")
+
+    def flush(self) -> None:
+        """
+        Emits and drops all the flows.
+        """
+
+        for slot in flatnonzero(self.__state & _USED).tolist():
+            self.__drop(slot, "flush")
+
+
+def track(path: str, capacity: int = 1 << 20, idle_timeout: float = 60, close_timeout: float = 1,
+          active_timeout: float = 3600, packets: Sequence[int] = (), times: Sequence[float] = (),
+          internal: Sequence[str] = (), interval: float = 1) -> Iterator[Tuple[str, List[str], bool]]:
+    """
+    Tracks the flows of a capture, which can be a pipe that is continuously written, with a `FlowTable`.
+
+    :param path: the name of the capture file or "-" for the standard input
+    :param capacity: the maximum number of flows tracked at once
+    :param idle_timeout: the seconds without packets after which a flow is emitted and dropped
+    :param close_timeout: the seconds without packets after which a closed flow is emitted and dropped
+    :param active_timeout: the seconds after which a flow is emitted and dropped
+    :param packets: the packet count thresholds
+    :param times: the time thresholds in seconds
+    :param internal: the internal networks, used for the c_isint and s_isint columns
+    :param interval: the seconds of capture time between two expirations of the flows
+    :return: an iterator of tuples with the reason of the emission, the values of all the `columns` and if the flow is
+             complete
+    """
+
+    with open_capture(path) as reader:
+        link_type = reader.link_type
+        resolution = reader.resolution
+        table = FlowTable(resolution, capacity, idle_timeout, close_timeout, active_timeout, packets, times, internal)
+        step = int(interval * resolution)
+        deadline = None
+        for time, _, data in reader:
+            segment = decode(link_type, data)
+            if segment is not None:
+                table.update(segment, time)
+            if deadline is None:
+                deadline = time + step
+            elif time >= deadline:
+                table.expire(time)
+                deadline = time + step
+            yield from table.pop()
+
+        table.flush()
+        yield from table.pop()
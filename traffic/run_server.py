@@ -0,0 +1,52 @@
+from argparse import ArgumentParser
+from asyncio import gather
+from asyncio import get_event_loop
+from json import load
+from resource import RLIMIT_NOFILE
+from resource import getrlimit
+from resource import setrlimit
+from ssl import PROTOCOL_TLS_SERVER
+from ssl import SSLContext
+
+from capturing import Site
+from capturing import StandInServer
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Serves a synthetic site to be used as the target of the traffic generation tools")
+parser.add_argument("--host", default="127.0.0.1", help="the comma-separated addresses to listen on")
+parser.add_argument("--http_port", type=int, default=8080, help="the HTTP port (0 to disable HTTP)")
+parser.add_argument("--https_port", type=int, default=8443, help="the HTTPS port (0 to disable HTTPS)")
+parser.add_argument("--certificate", default=None, help="the PEM certificate for HTTPS, also containing the key if "
+                                                        "--key is not used (HTTPS is disabled without it)")
+parser.add_argument("--key", default=None, help="the PEM key for HTTPS")
+parser.add_argument("--timeout", type=float, default=None,
+                    help="the seconds to wait for a client before closing its connection (default: wait forever)")
+parser.add_argument("--rate", type=float, default=None, help="the maximum bytes per second sent to every connection")
+parser.add_argument("profile", nargs="?", default=None,
+                    help="the JSON site profile, with the optional pages, fanout, assets, sizes (the [minimum, "
+                         "maximum] bytes of every content type), latency ([minimum, maximum] seconds) and seed keys")
+args = parser.parse_args()
+
+# Loads the site profile.
+profile = {}
+if args.profile is not None:
+    with open(args.profile) as f:
+        profile = load(f)
+server = StandInServer(Site(**profile), args.timeout, args.rate)
+hosts = args.host.split(",")
+
+# Allows as many concurrent connections as possible.
+_, limit = getrlimit(RLIMIT_NOFILE)
+setrlimit(RLIMIT_NOFILE, (limit, limit))
+
+# Serves the site.
+servers = []
+if args.http_port > 0:
+    servers.append(server.serve(hosts, args.http_port))
+    print("Serving HTTP on %s:%d" % (args.host, args.http_port))
+if args.https_port > 0 and args.certificate is not None:
+    context = SSLContext(PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(args.certificate, args.key)
+    servers.append(server.serve(hosts, args.https_port, context))
+    print("Serving HTTPS on %s:%d" % (args.host, args.https_port))
+get_event_loop().run_until_complete(gather(*servers))
@@ -0,0 +1,37 @@
+from argparse import ArgumentParser
+from os import makedirs
+
+from processing import columns
+from processing import track
+
+# Parses the input arguments.
+parser = ArgumentParser(description="Continuously tracks the flows of a capture and writes them as tstat logs")
+parser.add_argument("--capacity", type=int, default=1 << 20, help="the maximum number of flows tracked at once")
+parser.add_argument("--idle_timeout", type=float, default=60,
+                    help="the seconds without packets after which a flow is emitted and dropped")
+parser.add_argument("--close_timeout", type=float, default=1,
+                    help="the seconds without packets after which a closed flow is emitted and dropped")
+parser.add_argument("--active_timeout", type=float, default=3600,
+                    help="the seconds after which a flow is emitted and dropped")
+parser.add_argument("--packets", default="", help="the comma separated packet count thresholds for emitting a flow")
+parser.add_argument("--times", default="", help="the comma separated time thresholds in seconds for emitting a flow")
+parser.add_argument("--internal", default="", help="the comma separated internal networks")
+parser.add_argument("--interval", type=float, default=1, help="the seconds between two expirations of the flows")
+parser.add_argument("pcap", help="the name of the capture file or pipe (- for the standard input)")
+parser.add_argument("logs", help="the folder that will contain the log_tcp_complete and log_tcp_nocomplete files")
+args = parser.parse_args()
+
+packets = [int(i) for i in args.packets.split(",") if i]
+times = [float(i) for i in args.times.split(",") if i]
+internal = [i for i in args.internal.split(",") if i]
+
+# Tracks the flows, writing every one as soon as it is emitted.
+makedirs(args.logs, exist_ok=True)
+header = "#%s" % " ".join("%s:%d" % (c, i + 1) for i, c in enumerate(columns))
+with open("%s/log_tcp_complete" % args.logs, "w", buffering=1) as complete, \
+        open("%s/log_tcp_nocomplete" % args.logs, "w", buffering=1) as nocomplete:
+    print(header, file=complete)
+    print(header, file=nocomplete)
+    for _, row, done in track(args.pcap, args.capacity, args.idle_timeout, args.close_timeout, args.active_timeout,
+                              packets, times, internal, args.interval):
+        print(" ".join(row), file=complete if done else nocomplete)